@@ -1,24 +1,58 @@
+import argparse
+import multiprocessing
+from pathlib import Path
+
 import pygame
 
 from scripts.orchester import Orchester
 from scripts.const import Sizes
+from scripts.elements import load_element_module
+from scripts.event_replay import Recorder
+from scripts.tracing import tracer
 
-def main():
+def main(record:Path|None = None, trace:bool = False, elements:list[Path] = ()):
+    pygame.mixer.pre_init(buffer=Sizes.mixer_buffer) # the scrubber times its grains to the buffer
     pygame.init()
     pygame.mixer.init()
 
+    for path in elements: # before the orchester so the first song gets them already
+        load_element_module(path)
+
     window = pygame.display.set_mode(Sizes.window, pygame.SRCALPHA)
     clock = pygame.Clock()
     orchester = Orchester(window, None)
+    orchester.library.rescan() # picks up files that changed since the last start
+    recorder = Recorder(record, window.size) if record else None
+    tracer.enabled = tracer.enabled or trace
+
+    try:
+        loop(orchester, clock, recorder)
+    finally:
+        if recorder:
+            recorder.save()
+        tracer.save()
 
+def loop(orchester:Orchester, clock:pygame.Clock, recorder:Recorder|None):
     while True:
-        for event in pygame.event.get():
+        events = pygame.event.get()
+        if recorder:
+            recorder.record(events, orchester)
+        for event in events:
             orchester.handle_event(event)
 
         orchester.draw()
         pygame.display.flip()
-        pygame.display.set_caption(f"{clock.get_fps():.0f}")
+        caption = f"{clock.get_fps():.0f}"
+        if orchester.music_player is not None:
+            caption += f" | {orchester.music_player.clock.report()}"
+        pygame.display.set_caption(caption)
         clock.tick(Sizes.preview_fps)
 
 if __name__ == "__main__":
-    main()
+    multiprocessing.freeze_support() # the library scanner uses worker processes, needed for pyinstaller builds
+    parser = argparse.ArgumentParser(description="music-share")
+    parser.add_argument("--record", type=Path, help="record the input events to this json file, replay it with scripts.event_replay")
+    parser.add_argument("--trace", action="store_true", help="write a chrome trace of loading and rendering to tmp/trace.json")
+    parser.add_argument("--element", type=Path, action="append", default=[], help="python file registering extra visual elements, can be given several times")
+    args = parser.parse_args()
+    main(args.record, args.trace, args.element)
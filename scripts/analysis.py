@@ -0,0 +1,374 @@
+import json
+import time
+from pathlib import Path
+from types import MappingProxyType
+from dataclasses import dataclass, fields
+from contextlib import contextmanager
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .const import Sizes
+from .tracing import tracer
+
+# K-weighting filters from ITU-R BS.1770 (defined at 48kHz), used to weight the stft power per frame
+K_WEIGHT_SHELF = np.array([1.53512485958697, -2.69169618940638, 1.19839281085285]), np.array([1.0, -1.69065929318241, 0.73248077421585])
+K_WEIGHT_HIGHPASS = np.array([1.0, -2.0, 1.0]), np.array([1.0, -1.99004745483398, 0.99007225036621])
+
+
+@dataclass(frozen=True)
+class SongAnalysis:
+    """ everything the audio elements need, computed in one pass over the song by analyse_song """
+    sample_rate: int
+    amount_samples: int
+    song_length: float                      # seconds
+    chunk_size: int                         # samples per entry in chunk_amplitudes and peak_pyramid[0]
+    chunk_amplitudes: np.ndarray            # mean abs amplitude per chunk
+    peak_pyramid: tuple[np.ndarray, ...]    # max abs amplitude per chunk, every level halves the previous one
+    clipping: np.ndarray                    # (n, 2) start/end sample of every clipping interval
+    freq_bands: np.ndarray                  # center frequency of every equalizer band
+    eq_frames: np.ndarray                   # (amount_windows, amount_bars) stft band magnitudes
+    channel_eq_frames: np.ndarray|None      # (channels, amount_windows, amount_bars) float32 band magnitudes per channel, None for mono songs
+    rms: float                              # dBFS
+    lufs: float                             # integrated loudness, gated like BS.1770
+    true_peak: float                        # dBTP, 4x oversampled
+    timings: MappingProxyType               # stage name -> seconds
+
+    @property
+    def amount_windows(self) -> int:
+        return len(self.eq_frames)
+
+    def block_amplitudes(self, amount_blocks:int) -> np.ndarray:
+        """ mean abs amplitude of amount_blocks equally long blocks, normalized to 0..1 """
+        edges = np.linspace(0, len(self.chunk_amplitudes), amount_blocks + 1, dtype=int)
+        sums = np.concatenate(([0], np.cumsum(self.chunk_amplitudes)))
+        counts = np.maximum(edges[1:] - edges[:-1], 1)
+        amp = (sums[edges[1:]] - sums[edges[:-1]]) / counts
+        return amp / np.max(amp) if np.max(amp) > 0 else amp
+
+    def has_clipping(self, start:int, end:int) -> bool:
+        """ checks if any clipping interval overlaps the samples start..end """
+        idx = np.searchsorted(self.clipping[:, 0], end)
+        return bool(idx > 0 and self.clipping[idx-1, 1] > start)
+
+    def report(self) -> str:
+        stages = ", ".join(f"{name} {seconds*1000:.0f}ms" for name, seconds in self.timings.items())
+        return f"rms {self.rms:.1f} dBFS | loudness {self.lufs:.1f} LUFS | true peak {self.true_peak:.1f} dBTP | {stages}"
+
+    def __reduce__(self):
+        """ mappingproxy cant be pickled, timings go in as plain dict """
+        values = {field.name: getattr(self, field.name) for field in fields(self)}
+        values["timings"] = dict(self.timings)
+        return _unpickle_analysis, (values,)
+
+def _unpickle_analysis(values:dict) -> SongAnalysis:
+    return SongAnalysis(**(values | {"timings": MappingProxyType(values["timings"])}))
+
+
+def _readonly(array:np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+def _k_weights(sample_rate:int, window_size:int) -> np.ndarray:
+    """ squared magnitude response of the K-weighting filters for every rfft bin """
+    freqs = np.minimum(np.fft.rfftfreq(window_size, 1/sample_rate), 23999)
+    z = np.exp(-2j * np.pi * freqs / 48000)
+    response = np.ones_like(z)
+    for b, a in (K_WEIGHT_SHELF, K_WEIGHT_HIGHPASS):
+        response *= (b[0] + b[1]*z + b[2]*z**2) / (a[0] + a[1]*z + a[2]*z**2)
+    return np.abs(response) ** 2
+
+def _oversample_filter() -> np.ndarray:
+    """ windowed sinc interpolation filter for true peak, shape (phases, taps) """
+    factor = Sizes.true_peak_oversampling
+    taps = Sizes.true_peak_taps * factor
+    n = np.arange(taps) - (taps - 1) / 2
+    h = np.sinc(n / factor) * np.hanning(taps)
+    return np.stack([h[p::factor] for p in range(factor)]) / np.sum(h) * factor
+
+def _gated_loudness(frame_power:np.ndarray, sample_rate:int) -> float:
+    """ integrated loudness from per stft frame mean square, gated with 400ms blocks like BS.1770 """
+    frames_per_block = max(1, round(0.4 * sample_rate / Sizes.fft_hop_size))
+    step = max(1, frames_per_block // 4)
+    if len(frame_power) < frames_per_block:
+        blocks = np.array([np.mean(frame_power)]) if len(frame_power) else np.array([0.])
+    else:
+        sums = np.concatenate(([0], np.cumsum(frame_power)))
+        starts = np.arange(0, len(frame_power) - frames_per_block + 1, step)
+        blocks = (sums[starts + frames_per_block] - sums[starts]) / frames_per_block
+
+    loudness = lambda power: -0.691 + 10 * np.log10(np.maximum(power, 1e-20))
+    blocks = blocks[loudness(blocks) > -70] # absolute gate
+    if blocks.size == 0:
+        return -70.
+    blocks = blocks[loudness(blocks) > loudness(np.mean(blocks)) - 10] # relative gate
+    return float(loudness(np.mean(blocks)))
+
+def analyse_song(song_data:np.ndarray, sample_rate:int, channel_data:np.ndarray|None = None) -> SongAnalysis:
+    """ walks the mono song data once in blocks and produces every derived product the elements need
+    with channel_data (samples, 2) of a stereo song, song_data being its mean, the stft also gives the bands per channel:
+    mid (the mono data) and side go through one batched rfft, left and right bands are mid + side and mid - side
+    at the band bins, so stereo only adds the fft of the side signal and the mono results stay the same """
+    timings:dict[str, float] = {}
+
+    @contextmanager
+    def stage(name:str):
+        start = time.perf_counter()
+        yield
+        end = time.perf_counter()
+        timings[name] = timings.get(name, 0.) + end - start
+        if tracer.enabled:
+            tracer.complete(name, "analysis", start, end)
+
+    hop = Sizes.fft_hop_size
+    window_size = Sizes.fft_window_size
+    chunk = hop
+    amount_samples = len(song_data)
+    block_size = hop * Sizes.analysis_block_hops
+    amount_windows = max(0, (amount_samples - window_size) // hop + 1)
+    if channel_data is not None and (channel_data.ndim != 2 or channel_data.shape[1] != 2):
+        channel_data = None # mono (and surround) files only get the mono analysis
+
+    with stage("setup"):
+        freq_bands = np.geomspace(Sizes.fft_low_freq, Sizes.fft_high_freq, Sizes.amount_bars)
+        bin_freqs = np.fft.rfftfreq(window_size, 1/sample_rate)
+        target_bins = np.abs(bin_freqs[np.newaxis, :] - freq_bands[:, np.newaxis]).argmin(axis=1)
+        factor = np.logspace(0.1, 1, Sizes.amount_bars)
+        window = np.blackman(window_size)
+        # parseval for rfft: every bin except dc and nyquist counts twice, normalized by window energy
+        bin_weights = _k_weights(sample_rate, window_size) * 2
+        bin_weights[0] /= 2
+        if window_size % 2 == 0:
+            bin_weights[-1] /= 2
+        bin_weights /= window_size * np.sum(window**2)
+        oversample = _oversample_filter()
+
+        amount_chunks = -(-amount_samples // chunk)
+        chunk_amplitudes = np.zeros(amount_chunks)
+        chunk_peaks = np.zeros(amount_chunks)
+        eq_frames = np.zeros((amount_windows, Sizes.amount_bars))
+        channel_eq_frames = None if channel_data is None else np.zeros((2, amount_windows, Sizes.amount_bars), np.float32)
+        frame_power = np.zeros(amount_windows)
+        clip_intervals = []
+        square_sum = 0.
+        true_peak = 0.
+        history = np.zeros(oversample.shape[1] - 1)
+
+    for block_start in range(0, amount_samples, block_size):
+        block_end = min(block_start + block_size, amount_samples)
+        samples = song_data[block_start:block_end]
+        chunk_offset = block_start // chunk
+
+        with stage("amplitudes"):
+            amplitude = np.abs(samples)
+            chunk_starts = np.arange(0, len(samples), chunk)
+            lengths = np.diff(np.append(chunk_starts, len(samples)))
+            chunk_amplitudes[chunk_offset:chunk_offset+len(chunk_starts)] = np.add.reduceat(amplitude, chunk_starts) / lengths
+
+        with stage("peaks"):
+            chunk_peaks[chunk_offset:chunk_offset+len(chunk_starts)] = np.maximum.reduceat(amplitude, chunk_starts)
+
+        with stage("clipping"):
+            edges = np.diff((amplitude > Sizes.clipping_threshold).astype(np.int8), prepend=0, append=0)
+            starts = np.flatnonzero(edges == 1)
+            if starts.size:
+                clip_intervals.append(np.stack((starts, np.flatnonzero(edges == -1)), axis=1) + block_start)
+
+        with stage("loudness"):
+            square_sum += float(np.dot(samples, samples))
+
+        with stage("true_peak"):
+            extended = np.concatenate((history, samples))
+            for phase in oversample:
+                true_peak = max(true_peak, float(np.max(np.abs(np.convolve(extended, phase, "valid")))))
+            history = extended[len(extended) - len(history):]
+
+        with stage("stft"):
+            first = block_start // hop
+            last = min(amount_windows, -(-block_end // hop))
+            if first < last:
+                segment = slice(first*hop, (last-1)*hop + window_size)
+                if channel_data is None:
+                    frames = sliding_window_view(song_data[segment], window_size)[::hop]
+                    spectrum = np.fft.rfft(frames * window, axis=1)
+                else: # (mid/side, frames, window) view, one rfft call for both
+                    stereo = channel_data[segment]
+                    mid_side = np.stack((song_data[segment], (stereo[:, 0] - stereo[:, 1]) * 0.5))
+                    frames = sliding_window_view(mid_side, window_size, axis=1)[:, ::hop]
+                    spectrum, side = np.fft.rfft(frames * window, axis=-1)
+                    mid_bands, side_bands = spectrum[:, target_bins], side[:, target_bins]
+                    channel_eq_frames[:, first:last] = np.abs((mid_bands + side_bands, mid_bands - side_bands)) * factor
+                eq_frames[first:last] = np.abs(spectrum[:, target_bins]) * factor
+                frame_power[first:last] = (spectrum.real**2 + spectrum.imag**2) @ bin_weights
+
+    with stage("clipping"):
+        if clip_intervals:
+            clipping = np.concatenate(clip_intervals)
+            group_start = np.concatenate(([True], clipping[1:, 0] != clipping[:-1, 1])) # merge intervals split by a block border
+            group_end = np.append(group_start[1:], True)
+            clipping = np.stack((clipping[group_start, 0], clipping[group_end, 1]), axis=1)
+        else:
+            clipping = np.zeros((0, 2), dtype=int)
+
+    with stage("peaks"):
+        pyramid = [chunk_peaks]
+        while len(pyramid[-1]) > 1:
+            level = pyramid[-1]
+            if len(level) % 2:
+                level = np.append(level, 0)
+            pyramid.append(np.maximum(level[0::2], level[1::2]))
+
+    with stage("loudness"):
+        rms = 10 * np.log10(max(square_sum / max(amount_samples, 1), 1e-20))
+        lufs = _gated_loudness(frame_power, sample_rate)
+
+    return SongAnalysis(
+        sample_rate = sample_rate,
+        amount_samples = amount_samples,
+        song_length = amount_samples / sample_rate,
+        chunk_size = chunk,
+        chunk_amplitudes = _readonly(chunk_amplitudes),
+        peak_pyramid = tuple(_readonly(level) for level in pyramid),
+        clipping = _readonly(clipping),
+        freq_bands = _readonly(freq_bands),
+        eq_frames = _readonly(eq_frames),
+        channel_eq_frames = None if channel_eq_frames is None else _readonly(channel_eq_frames),
+        rms = float(rms),
+        lufs = lufs,
+        true_peak = float(20 * np.log10(max(true_peak, 1e-10))),
+        timings = MappingProxyType(timings),
+    )
+
+def save_analysis(analysis:SongAnalysis, path:Path):
+    """ stores the analysis as npz, the small values go into a json string next to the arrays """
+    scalars = {
+        "sample_rate": analysis.sample_rate,
+        "amount_samples": analysis.amount_samples,
+        "song_length": analysis.song_length,
+        "chunk_size": analysis.chunk_size,
+        "rms": analysis.rms,
+        "lufs": analysis.lufs,
+        "true_peak": analysis.true_peak,
+        "timings": dict(analysis.timings),
+    }
+    pyramid = {f"peak_{i}": level for i, level in enumerate(analysis.peak_pyramid)}
+    channels = {} if analysis.channel_eq_frames is None else {"channel_eq_frames": analysis.channel_eq_frames}
+    with open(path, "wb") as f: # file object, so numpy doesnt append .npz to the name
+        np.savez(
+            f,
+            scalars = np.array(json.dumps(scalars)),
+            chunk_amplitudes = analysis.chunk_amplitudes,
+            clipping = analysis.clipping,
+            freq_bands = analysis.freq_bands,
+            eq_frames = analysis.eq_frames,
+            **pyramid,
+            **channels,
+        )
+
+def load_analysis(path:Path) -> SongAnalysis:
+    with np.load(path) as data:
+        scalars = json.loads(str(data["scalars"]))
+        pyramid = tuple(_readonly(data[f"peak_{i}"]) for i in range(sum(name.startswith("peak_") for name in data.files)))
+        return SongAnalysis(
+            sample_rate = scalars["sample_rate"],
+            amount_samples = scalars["amount_samples"],
+            song_length = scalars["song_length"],
+            chunk_size = scalars["chunk_size"],
+            chunk_amplitudes = _readonly(data["chunk_amplitudes"]),
+            peak_pyramid = pyramid,
+            clipping = _readonly(data["clipping"]),
+            freq_bands = _readonly(data["freq_bands"]),
+            eq_frames = _readonly(data["eq_frames"]),
+            channel_eq_frames = _readonly(data["channel_eq_frames"]) if "channel_eq_frames" in data.files else None,
+            rms = scalars["rms"],
+            lufs = scalars["lufs"],
+            true_peak = scalars["true_peak"],
+            timings = MappingProxyType(scalars["timings"]),
+        )
+
+def _window_means(values:np.ndarray, length:int) -> np.ndarray:
+    """ mean over every window of length entries along the first axis, via prefix sums """
+    sums = np.concatenate((np.zeros((1,) + values.shape[1:]), np.cumsum(values, axis=0)))
+    return (sums[length:] - sums[:-length]) / length
+
+def _standardize(values:np.ndarray) -> np.ndarray:
+    std = np.std(values)
+    return (values - np.mean(values)) / std if std > 0 else np.zeros_like(values)
+
+def find_highlights(analysis:SongAnalysis, length:float, amount:int) -> list[tuple[float, float, float]]:
+    """ the amount best non overlapping clips of length seconds as (start, end, score), best first
+
+    every clip start gets scored by loudness and spectral flux inside the clip, plus how much the
+    spectrum changes right at its start (novelty), so clips tend to begin where a section begins
+    """
+    # clip starts a few hops apart are plenty, so pool the frames first, everything below gets that much cheaper
+    step = Sizes.highlight_step
+    step_time = step * Sizes.fft_hop_size / analysis.sample_rate
+    amount_steps = len(analysis.eq_frames) // step
+    frames = np.log1p(analysis.eq_frames[:amount_steps*step].reshape(amount_steps, step, -1).mean(axis=1, dtype=np.float32))
+    energy = analysis.chunk_amplitudes[:amount_steps*step].reshape(amount_steps, step).mean(axis=1)
+    clip = int(length / step_time)
+    context = max(1, min(int(Sizes.highlight_context / step_time), len(frames) // 2))
+    if clip < 1 or len(frames) < clip + 1:
+        return []
+
+    flux = np.concatenate(([0], np.sum(np.maximum(np.diff(frames, axis=0), 0), axis=1))) # only rising bands, onsets not decays
+
+    # novelty at step i: distance between the mean spectrum of the context before and after it
+    means = _window_means(frames, context)
+    novelty = np.zeros(len(frames))
+    novelty[context:len(frames)-context+1] = np.linalg.norm(means[context:] - means[:-context], axis=1)
+
+    starts = len(frames) - clip + 1
+    score = (
+        Sizes.highlight_weights[0] * _standardize(_window_means(energy, clip))
+        + Sizes.highlight_weights[1] * _standardize(_window_means(flux, clip))
+        + Sizes.highlight_weights[2] * _standardize(novelty[:starts])
+    )
+
+    highlights = []
+    for _ in range(amount):
+        best = int(np.argmax(score))
+        if not np.isfinite(score[best]):
+            break
+        highlights.append((best * step_time, (best + clip) * step_time, float(score[best])))
+        score[max(0, best - clip + 1) : best + clip] = -np.inf # no overlapping clips
+    return highlights
+
+def smooth_levels(levels:np.ndarray, hop_time:float) -> np.ndarray:
+    """ attack/release smoothing of bar levels (frames, bars) like an analog spectrum analyzer, for the whole song at once
+
+    rises go through an exponential moving average with Sizes.eq_attack as time constant, truncated to the taps that matter,
+    falls decay exponentially with Sizes.eq_release. the decay is a running max in log space: a level seen s frames ago
+    is worth log(x) + s*log(r) now, so the envelope is t*log(r) + cummax(log(x[s]) - s*log(r)) without any frame loop
+    """
+    if Sizes.eq_attack > 0:
+        keep = np.exp(-hop_time / Sizes.eq_attack) # part of the last value kept per frame
+        taps = max(1, int(np.ceil(np.log(1e-3) / np.log(keep)))) if keep > 0 else 1
+        weights = keep ** np.arange(taps)
+        weights /= weights.sum()
+        padded = np.concatenate((np.repeat(levels[:1], taps - 1, axis=0), levels))
+        attacked = sum(weight * padded[taps-1-k : len(padded)-k] for k, weight in enumerate(weights))
+    else:
+        attacked = levels
+
+    if Sizes.eq_release <= 0:
+        return attacked
+    log_keep = -hop_time / Sizes.eq_release
+    steps = np.arange(len(levels))[:, np.newaxis] * log_keep
+    envelope = steps + np.maximum.accumulate(np.log(np.maximum(attacked, 1e-12)) - steps, axis=0)
+    return np.exp(envelope)
+
+def peak_levels(levels:np.ndarray, hop_time:float) -> np.ndarray|None:
+    """ peak hold markers for every frame, the highest level stays Sizes.eq_peak_hold seconds and then falls Sizes.eq_peak_fall per second
+    a peak from d frames ago is at x - fall*max(0, d-hold): the max over the hold window, and before that a running max of x + fall*s
+    shifted by the hold. None if the markers are turned off """
+    if Sizes.eq_peak_fall <= 0:
+        return None
+    hold = int(round(Sizes.eq_peak_hold / hop_time))
+    fall = Sizes.eq_peak_fall * hop_time
+    held = sliding_window_view(np.concatenate((np.zeros((hold,) + levels.shape[1:]), levels)), hold + 1, axis=0).max(axis=-1)
+    frames = np.arange(len(levels))[:, np.newaxis]
+    falling = np.maximum.accumulate(levels + fall * frames, axis=0)[:max(0, len(levels) - hold - 1)] - fall * frames[hold+1:] + fall * hold
+    held[hold+1:] = np.maximum(held[hold+1:], falling)
+    return np.clip(held, 0, 1)
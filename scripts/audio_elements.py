@@ -6,16 +6,65 @@ import pygame
 import numpy as np
 
 from .const import Colors, Sizes, SVGs
+from .analysis import smooth_levels, peak_levels
+from .elements import Element, register_element
+from .song_cache import PreparedSong
+
+class PlaybackClock:
+    """ playhead of the music stream, counted from the samples the mixer handed to the device instead of the wall clock
+
+    `python -m scripts.clock_check` plays an hour long track through a simulated mixer and checks it against the samples actually heard
+    """
+    def __init__(self, get_pos=None, latency:float|None=None, now=time.perf_counter) -> None:
+        # ms of samples handed to the device plus the sdl ticks since that last callback, paused it only counts the samples
+        self.get_pos = get_pos or pygame.mixer_music.get_pos
+        self.latency = Sizes.mixer_buffer / pygame.mixer.get_init()[0] if latency is None else latency # one buffer sits in the device before its heard
+        self.now = now
+        self.offset = 0.                # song position at which get_pos was 0
+        self.seek_pos = 0.              # nothing before this is heard after a seek, even with latency compensation
+        self.last = 0.
+        self.held = 0.                  # seconds the position was held because get_pos stepped back, a callback came before the ticks it replaces
+        self.max_held = 0.
+        self.wall = 0.                  # where a wall clock started at the last seek would think the song is
+        self.wall_drift = 0.            # returned position minus that, how far the old time.time() playhead would be off
+        self.previous_call = None
+
+    def seek(self, position:float):
+        self.offset = position - max(0, self.get_pos()) / 1000
+        self.seek_pos = self.last = self.wall = position
+
+    def position(self, playing:bool) -> float:
+        played = self.get_pos()
+        if played < 0: # stopped, nothing to count
+            return self.last
+        now = self.now()
+        if playing and self.previous_call is not None:
+            self.wall += now - self.previous_call
+        self.previous_call = now if playing else None
+
+        delivered = self.offset + played / 1000
+        if not playing: # the device drained its buffer, everything delivered was heard
+            self.last = self.wall = delivered
+            return delivered
+
+        heard = max(self.seek_pos, delivered - self.latency)
+        estimate = max(self.last, heard) # never backwards
+        self.held = estimate - heard
+        self.max_held = max(self.max_held, self.held)
+        self.wall_drift = estimate - self.wall
+        self.last = estimate
+        return estimate
+
+    def report(self) -> str:
+        return f"clock held {self.held*1000:.1f}ms (max {self.max_held*1000:.1f}ms), wall clock off by {self.wall_drift*1000:.0f}ms"
 
 class MusicPlayer:
     def __init__(self, song_path:Path, autoplay=True, startpos=0.):
-        self.beginnig = 0
-        self.current_time = 0
-        self.beginnig = time.time()
         self.playing = autoplay
 
         pygame.mixer_music.load(song_path)
         pygame.mixer_music.play()
+        self.clock = PlaybackClock()
 
         if startpos>0.:
             self.play_from_position(startpos)
@@ -24,26 +73,21 @@ class MusicPlayer:
             pygame.mixer_music.pause()
 
     def play_from_position(self, position_seconds):
-        self.current_time = position_seconds
-        self.beginnig = time.time() - position_seconds
-        if not pygame.mixer_music.get_busy():
-            pygame.mixer_music.play()
+        # play restarts get_pos at 0, set_pos would leave the ticks since the last callback in the clock offset (up to a buffer behind until the next seek)
+        pygame.mixer_music.play(start=position_seconds)
+        if not self.playing:
             pygame.mixer_music.pause()
-        pygame.mixer.music.set_pos(position_seconds)
+        self.clock.seek(position_seconds)
 
     def get_current_position(self):
-        if pygame.mixer_music.get_busy():
-            return time.time() - self.beginnig
-        return self.current_time
+        return self.clock.position(self.playing)
 
     def pause(self):
         self.playing = False
-        self.current_time = self.get_current_position()
         pygame.mixer_music.pause()
 
     def resume(self):
         self.playing = True
-        self.beginnig = time.time() - self.current_time
         pygame.mixer_music.unpause()
 
     def toggle_pause(self):
@@ -54,75 +98,163 @@ class MusicPlayer:
 
     def set_song(self, song_path:Path):
         pygame.mixer_music.load(song_path)
-        self.beginnig = time.time()
         self.playing = True
         pygame.mixer_music.play()
+        self.clock.seek(0)
 
-class ScrubBar:
-    def __init__(self, rect:pygame.Rect, song_data:np.ndarray, sample_rate:int) -> None:
-        self.song_data = song_data
+class Scrubber:
+    """ plays short grains of the decoded song while the scrubbar is dragged, instead of seeking the music stream every mouse move """
+    def __init__(self, song_data:np.ndarray, sample_rate:int) -> None:
+        self.song_data = song_data if song_data.ndim > 1 else song_data[:, np.newaxis]
         self.sample_rate = sample_rate
-        self.song_length = len(song_data) / sample_rate
+        self.mixer_rate, self.mixer_size, self.mixer_channels = pygame.mixer.get_init()
+        self.cadence = Sizes.mixer_buffer / self.mixer_rate # seconds between two audio callbacks, no use in starting grains faster
+
+        grain = int(Sizes.scrub_grain * sample_rate)
+        fade = min(int(Sizes.scrub_fade * sample_rate), grain // 2)
+        self.envelope = np.ones(grain, dtype=np.float32)
+        self.envelope[:fade] = np.hanning(2 * fade)[:fade] # fade in and out so cutting grains off doesnt click
+        self.envelope[grain-fade:] = np.hanning(2 * fade)[fade:]
+
+        pygame.mixer.set_reserved(2) # two channels to crossfade between, music runs on its own anyway
+        self.channels = pygame.mixer.Channel(0), pygame.mixer.Channel(1)
+        self.current = 0
+        self.active = False
+        self.was_playing = False
+        self.pending:tuple[float, float]|None = None # position and time it was asked for, waiting for the next callback
+        self.last_grain = 0.
+        self.latencies:list[float] = []
+
+    def make_grain(self, position:float) -> pygame.mixer.Sound:
+        start = min(max(0, int(position * self.sample_rate)), len(self.song_data) - 1)
+        samples = self.song_data[start : start + len(self.envelope)] * self.envelope[:min(len(self.envelope), len(self.song_data) - start), np.newaxis]
+
+        if self.sample_rate != self.mixer_rate: # nearest sample resampling is plenty for a scrub preview
+            samples = samples[(np.arange(int(len(samples) * self.mixer_rate / self.sample_rate)) * self.sample_rate / self.mixer_rate).astype(int)]
+        if samples.shape[1] != self.mixer_channels:
+            samples = np.repeat(samples.mean(axis=1, keepdims=True), self.mixer_channels, axis=1)
+        if self.mixer_channels == 1:
+            samples = samples[:, 0]
+
+        if self.mixer_size == 32: # float mixer
+            samples = samples.astype(np.float32)
+        else:
+            bits = abs(self.mixer_size)
+            offset = 0 if self.mixer_size < 0 else 2 ** (bits - 1) # unsigned formats are centered around half the range
+            dtype = np.dtype(f"{'int' if self.mixer_size < 0 else 'uint'}{bits}")
+            samples = (np.clip(samples, -1, 1) * (2 ** (bits - 1) - 1) + offset).astype(dtype)
+        return pygame.sndarray.make_sound(np.ascontiguousarray(samples))
+
+    def begin(self, music_player:"MusicPlayer"):
+        self.active = True
+        self.was_playing = music_player.playing
+        self.latencies = []
+        if music_player.playing:
+            music_player.pause()
+
+    def scrub(self, position:float):
+        """ asks for a grain at position, it starts right away or with the next update if the last one is too recent """
+        self.pending = position, time.perf_counter()
+        self.update()
+
+    def update(self):
+        if self.pending is None or time.perf_counter() - self.last_grain < self.cadence:
+            return
+        position, asked = self.pending
+        self.pending = None
+        sound = self.make_grain(position)
+        self.channels[self.current].fadeout(int(Sizes.scrub_fade * 1000))
+        self.current = 1 - self.current
+        self.channels[self.current].play(sound)
+        self.last_grain = time.perf_counter()
+        self.latencies.append(self.last_grain - asked + self.cadence) # plus one buffer until the mixer actually plays it
+
+    def end(self, music_player:"MusicPlayer", position:float):
+        """ stops the grains and continues the normal stream at position """
+        self.active = False
+        self.pending = None
+        for channel in self.channels:
+            channel.fadeout(int(Sizes.scrub_fade * 1000))
+        music_player.play_from_position(position)
+        if self.was_playing:
+            music_player.resume()
+        if self.latencies:
+            print(self.latency_report())
+
+    def latency_report(self) -> str:
+        latencies = np.array(self.latencies) * 1000
+        return f"scrub: {len(latencies)} grains, latency mean {latencies.mean():.1f}ms, p95 {np.percentile(latencies, 95):.1f}ms, max {latencies.max():.1f}ms"
+
+class ScrubBar(Element):
+    name = "scrubbar"
+    position = "scrubbar"
+    per_clip = True # start/end differ between clips
+
+    def __init__(self, rect:pygame.Rect, song:PreparedSong) -> None:
+        analysis = song.analysis
+        self.analysis = analysis
+        self.sample_rate = analysis.sample_rate
+        self.song_length = analysis.song_length
 
         self.current_time = 0.0
         self.start_pos = 0.0
         self.end_pos = self.song_length
         self.pressed_left = False
         self.pressed_right = False
+        self.highlights:list[tuple[float, float, float]] = [] # suggested clips from find_highlights
+        self.selected_highlight:int|None = None
+        self.clips:list[tuple[float, float]] = [] # start/end of every clip queued for a batch render
+        self.colors:list[tuple[pygame.Color, pygame.Color|None]] = []
 
-        self.resize(rect)
+        self.calc_bar_times()
+        super().__init__(rect)
 
-    def render_background(self):
-        self.background = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+    def render_background(self) -> pygame.Surface:
+        background = pygame.Surface(self.rect.size, pygame.SRCALPHA)
 
         fade_size = int(Sizes.background_fade * self.rect.height)
         height_constant_color = self.rect.height - fade_size
         fade_rect = (0, fade_size, self.rect.width, height_constant_color)
-        pygame.draw.rect(self.background, Colors.background_music_elements, fade_rect)
+        pygame.draw.rect(background, Colors.background_music_elements, fade_rect)
 
         alpha_values = np.linspace(0, Colors.background_music_elements.a, fade_size, dtype=int)
         y_positions = range(fade_size + 1)
 
         for alpha, ypos in zip(alpha_values, y_positions):
-            pygame.draw.line(self.background, (0,0,0,alpha), (0,ypos), (self.rect.right,ypos))
-
-    def calc_amplitudes(self):
-        self.bar_width = self.rect.width / Sizes.amount_bars * (1-Sizes.bar_padding)
-        #self.bar_width = self.rect.width / Sizes.amount_bars - Sizes.bar_padding
-        self.bar_radius = self.bar_width / 2
-        self.x_positions = np.linspace(0, self.rect.width - self.bar_width, Sizes.amount_bars, dtype=int)
-        #self.x_positions = np.linspace(Sizes.bar_padding/2, self.rect.width - self.bar_width - Sizes.bar_padding, Sizes.amount_bars, dtype=int)
+            pygame.draw.line(background, (0,0,0,alpha), (0,ypos), (self.rect.right,ypos))
+        return background
 
+    def calc_bar_times(self):
+        """ time range and amplitude of every bar, the same for every size so only done once per song """
         # Compute true time boundaries from audio
-        total_samples = len(self.song_data)
+        total_samples = self.analysis.amount_samples
         samples_per_bar = total_samples / Sizes.amount_bars  # keep as float for accuracy
         self.bar_time_starts = np.arange(Sizes.amount_bars) * (samples_per_bar / self.sample_rate)
         self.bar_time_ends = self.bar_time_starts + (samples_per_bar / self.sample_rate)
         self.bar_time_ends[-1] = self.song_length
 
-        # compute amplitudes from actual audio blocks
-        indices = np.linspace(0, total_samples, Sizes.amount_bars + 1, dtype=int)
-        blocks = [self.song_data[indices[i]:indices[i+1]] for i in range(Sizes.amount_bars)]
-        amp = np.array([np.mean(np.abs(b)) if len(b) > 0 else 0 for b in blocks])
-        amp = amp / np.max(amp) if np.max(amp) > 0 else amp
-        fade_size = self.rect.height * Sizes.background_fade
-        height = self.rect.height - fade_size
-        self.amplitude = (fade_size + height - height * amp).astype(int)
+        # amplitudes of the audio blocks come from the analysis, no need to touch the song data again
+        self.block_amplitudes = self.analysis.block_amplitudes(Sizes.amount_bars)
 
-    def draw(self) -> tuple[pygame.Surface, tuple[int,int]]:
-        surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
-        surface.blit(self.background, (0,0))
+    def make_view(self) -> dict:
+        bar_width = self.rect.width / Sizes.amount_bars * (1-Sizes.bar_padding)
+        #self.bar_width = self.rect.width / Sizes.amount_bars - Sizes.bar_padding
+        x_positions = np.linspace(0, self.rect.width - bar_width, Sizes.amount_bars, dtype=int)
+        #self.x_positions = np.linspace(Sizes.bar_padding/2, self.rect.width - self.bar_width - Sizes.bar_padding, Sizes.amount_bars, dtype=int)
 
-        for i, (x_pos, amp) in enumerate(zip(self.x_positions, self.amplitude)):
-            bar_time_start = self.bar_time_starts[i]
-            bar_time_end = self.bar_time_ends[i]
-            height = self.rect.height - amp
+        fade_size = self.rect.height * Sizes.background_fade
+        height = self.rect.height - fade_size
+        amplitude = (fade_size + height - height * self.block_amplitudes).astype(int)
+        return {"background": self.render_background(), "bar_width": bar_width, "bar_radius": bar_width / 2, "x_positions": x_positions, "amplitude": amplitude}
 
+    def bar_colors(self) -> list[tuple[pygame.Color, pygame.Color|None]]:
+        """ color of every bar and of its lower fade part, None if the bar is inside the render section """
+        colors = []
+        for bar_time_start, bar_time_end in zip(self.bar_time_starts, self.bar_time_ends):
             # full bar (playhead highlight)
             lerp_val = min(max(0, (self.current_time - bar_time_start) / (bar_time_end - bar_time_start)), 1)
             color_bar = pygame.Color.lerp(Colors.bar_dim, Colors.bar_bright, lerp_val)
-            pygame.draw.rect(surface, color_bar, (x_pos, amp, self.bar_width, height))
-            pygame.draw.circle(surface, color_bar, (x_pos + self.bar_radius, amp), self.bar_radius)
+            color_fade = None
 
             # fade regions (start/end)
             if not (self.start_pos <= bar_time_start and bar_time_end <= self.end_pos):
@@ -135,15 +267,53 @@ class ScrubBar:
                 else:
                     color_fade = Colors.bar_dark
 
+            colors.append((color_bar, color_fade))
+        return colors
+
+    def frame_state(self, position:float) -> tuple:
+        self.colors = self.bar_colors() # kept for draw_frame
+        bars = tuple((tuple(bar), fade and tuple(fade)) for bar, fade in self.colors)
+        return bars, tuple(self.highlights), self.selected_highlight, tuple(self.clips)
+
+    def select_highlight(self, index:int):
+        """ uses the suggested clip as start/end """
+        self.selected_highlight = index % len(self.highlights)
+        self.start_pos, self.end_pos, _ = self.highlights[self.selected_highlight]
+
+    def add_clip(self):
+        """ queues the current start/end for a batch render """
+        if (self.start_pos, self.end_pos) not in self.clips:
+            self.clips.append((self.start_pos, self.end_pos))
+            self.clips.sort()
+
+    def draw_marks(self, surface:pygame.Surface, marks:list[tuple[float, float]], colors:list[pygame.Color], y:int):
+        """ rounded strips over the time ranges of marks """
+        height = max(2, int(self.rect.height * Sizes.highlight_marker))
+        for (start, end), color in zip(marks, colors):
+            x_start = int(start / self.song_length * self.rect.width)
+            x_end = int(end / self.song_length * self.rect.width)
+            pygame.draw.rect(surface, color, (x_start, y, max(1, x_end - x_start), height), border_radius=height//2)
+
+    def draw_frame(self, surface:pygame.Surface, position:float):
+        for x_pos, amp, (color_bar, color_fade) in zip(self.x_positions, self.amplitude, self.colors):
+            height = self.rect.height - amp
+            pygame.draw.rect(surface, color_bar, (x_pos, amp, self.bar_width, height))
+            pygame.draw.circle(surface, color_bar, (x_pos + self.bar_radius, amp), self.bar_radius)
+
+            if color_fade is not None:
                 pygame.draw.rect(surface, color_fade, (x_pos, (self.rect.height + amp) // 2, self.bar_width, height // 2))
 
-        return surface, self.rect.topleft
+        highlight_colors = [Colors.highlight_selected if i == self.selected_highlight else Colors.highlight for i in range(len(self.highlights))]
+        self.draw_marks(surface, [(start, end) for start, end, _ in self.highlights], highlight_colors, 0)
+        clip_y = self.rect.height - max(2, int(self.rect.height * Sizes.highlight_marker))
+        self.draw_marks(surface, self.clips, [Colors.clip] * len(self.clips), clip_y)
 
     def handle_event(self, event:pygame.Event):
         def check_fade_pos():
             x_loacle = int(event.pos[0]) - self.rect.left
             song_pos = min(max(0,x_loacle / self.rect.width * self.song_length), self.song_length)
             deltas = (abs(self.start_pos - song_pos), abs(self.end_pos - song_pos))
+            self.selected_highlight = None
 
             if deltas[0] < deltas[1]:
                 self.start_pos = song_pos
@@ -169,6 +339,14 @@ class ScrubBar:
                     self.pressed_right = True
                     check_fade_pos()
 
+                elif event.button == 2: # middle mouse button picks the suggested clip under the cursor
+                    song_pos = (event.pos[0] - self.rect.left) / self.rect.width * self.song_length
+                    for i, (start, end, _) in enumerate(self.highlights):
+                        if start <= song_pos <= end:
+                            self.select_highlight(i)
+                            special_events.append("highlight selected")
+                            break
+
         elif event.type == pygame.MOUSEBUTTONUP:
             if event.button == 1: # left mouse button released
                 self.pressed_left = False
@@ -187,134 +365,219 @@ class ScrubBar:
 
         return special_events
 
-    def resize(self, rect:pygame.Rect):
-        self.rect = rect
-        self.render_background()
-        self.calc_amplitudes()
-
-    def copy(self, rect:pygame.Rect):
-        new_scrubbar = object.__new__(ScrubBar)
-        new_scrubbar.song_data = self.song_data.copy()
-        new_scrubbar.sample_rate = self.sample_rate
-        new_scrubbar.song_length = self.song_length
-        new_scrubbar.current_time = self.current_time
-        new_scrubbar.start_pos = self.start_pos
-        new_scrubbar.end_pos = self.end_pos
-        new_scrubbar.resize(rect)
-        return new_scrubbar
-
-class SoundWave:
-    def __init__(self, rect:pygame.Rect, song_data:np.ndarray, sample_rate:int) -> None:
-        self.song_data_raw = song_data
-        self.sample_rate = sample_rate
-        self.song_length = len(song_data) / sample_rate
-        self.clipping_data = np.abs(song_data) > 0.99
+    def reset_copy(self):
+        self.highlights = [] # suggestions are only for the preview, not the video
+        self.selected_highlight = None
+        self.clips = []
+        self.pressed_left = self.pressed_right = False
+
+class SoundWave(Element):
+    name = "soundwave"
+    position = "soundwave"
+
+    def __init__(self, rect:pygame.Rect, song:PreparedSong) -> None:
+        channel_data = song.song_data_full
+        self.song_data_raw = song.song_data_mono
+        self.channel_data = channel_data if channel_data.ndim == 2 and channel_data.shape[1] == 2 else None
+        self.stereo = Sizes.stereo # one trace per channel, only for stereo songs
+        self.analysis = song.analysis
+        self.sample_rate = song.analysis.sample_rate
+        self.song_length = song.analysis.song_length
         self.clipping_enabled = True
-        self.resize(rect)
+        super().__init__(rect)
 
-    def render_background(self):
-        self.background = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+    def render_background(self) -> pygame.Surface:
+        background = pygame.Surface(self.rect.size, pygame.SRCALPHA)
         fade_size = int(Sizes.background_fade * self.rect.height)
         height_constant_color = self.rect.height - fade_size
         rect = (0, 0, self.rect.width, height_constant_color)
-        pygame.draw.rect(self.background, Colors.background_music_elements, rect)
+        pygame.draw.rect(background, Colors.background_music_elements, rect)
         alpha_values = np.linspace(Colors.background_music_elements.a, 0, fade_size, dtype=int)
         y_positions = range(height_constant_color, self.rect.height+1)
 
         for alpha, ypos in zip(alpha_values, y_positions):
-            pygame.draw.line(self.background, (0,0,0,alpha), (0,ypos), (self.rect.right,ypos))
+            pygame.draw.line(background, (0,0,0,alpha), (0,ypos), (self.rect.right,ypos))
+        return background
+
+    def sample_pos(self, position:float) -> int:
+        return min(int(position * self.sample_rate), self.song_data_raw.size - Sizes.soundwave_samples - 1)
+
+    def show_clipping(self, start_pos:int) -> bool:
+        return self.clipping_enabled and self.analysis.has_clipping(start_pos, start_pos + Sizes.soundwave_samples)
+
+    def show_stereo(self) -> bool:
+        return self.stereo and self.channel_data is not None
+
+    def frame_state(self, position:float) -> tuple:
+        start_pos = self.sample_pos(position)
+        return start_pos, self.show_clipping(start_pos), self.show_stereo()
+
+    def draw_frame(self, surface:pygame.Surface, position:float):
+        start_pos = self.sample_pos(position)
+        x_pos = np.arange(Sizes.soundwave_samples) * surface.width / Sizes.soundwave_samples
+        if self.show_stereo(): # left channel in the upper half, right channel in the lower half
+            samples = self.channel_data[start_pos : start_pos + Sizes.soundwave_samples]
+            for channel in range(2):
+                y_pos = (samples[:, channel] + 1) * self.scale / 2 + channel * self.scale
+                pygame.draw.lines(surface, Colors.wave, False, np.stack((x_pos, y_pos), axis=1))
+        else:
+            samples = (self.song_data_raw[start_pos : start_pos + Sizes.soundwave_samples] + 1) * self.scale # only scale the visible samples
+            pygame.draw.lines(surface, Colors.wave, False, np.stack((x_pos, samples), axis=1))
 
-    def draw(self, position:float) -> tuple[pygame.Surface, tuple[int,int]]:
-        surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
-        surface.blit(self.background, (0,0))
+        if self.show_clipping(start_pos):
+            surface.blit(self.clipping_img, self.clipping_pos)
 
-        start_pos = min(int(position * self.sample_rate), self.song_data.size - Sizes.soundwave_samples - 1)
-        samples = self.song_data[start_pos : start_pos + Sizes.soundwave_samples]
-        x_pos = np.arange(samples.size) * surface.width / Sizes.soundwave_samples
-        points = np.stack((x_pos, samples), axis=1)
-        pygame.draw.lines(surface, Colors.wave, False, points)
+    def make_view(self) -> dict:
+        scale = (self.rect.height - Sizes.background_fade * self.rect.height) / 2 # normalize and scale (-1, 1) to (0, height-background_fade)
+        clipping_img = SVGs.clip(self.rect.height * Sizes.clipper_svg)
+        clipping_pos = self.rect.width * 0.01, (self.rect.height - Sizes.background_fade*self.rect.height) * 0.9
+        return {"background": self.render_background(), "scale": scale, "clipping_img": clipping_img, "clipping_pos": clipping_pos}
 
-        if np.any(self.clipping_data[start_pos : start_pos + Sizes.soundwave_samples]) and self.clipping_enabled:
-            surface.blit(self.clipping_img, self.clipping_pos)
+class Equalizer(Element):
+    name = "equalizer"
+    position = "eqalizer"
 
-        return surface, self.rect.topleft
-    
-    def resize(self, rect:pygame.Rect):
+    def __init__(self, rect:pygame.Rect, song:PreparedSong):
+        analysis = song.analysis
         self.rect = rect
-        self.render_background()
-        self.song_data = (self.song_data_raw + 1) / 2 * (self.rect.height - Sizes.background_fade * self.rect.height) # normalize and scale (-1, 1) to (0, height-background_fade)
-        self.clipping_img = SVGs.clip(self.rect.height * Sizes.clipper_svg)
-        self.clipping_pos = self.rect.width * 0.01, (self.rect.height - Sizes.background_fade*self.rect.height) * 0.9
-
-    def copy(self, rect:pygame.Rect):
-        new_soundwave = object.__new__(SoundWave)
-        new_soundwave.rect = rect
-        new_soundwave.song_data_raw = self.song_data_raw.copy()
-        new_soundwave.song_data = self.song_data.copy()
-        new_soundwave.sample_rate = self.sample_rate
-        new_soundwave.song_length = self.song_length
-        new_soundwave.clipping_data = self.clipping_data.copy()
-        new_soundwave.clipping_img = self.clipping_img.copy()
-        new_soundwave.clipping_enabled = self.clipping_enabled
-        new_soundwave.resize(rect)
-        return new_soundwave
-
-class Equalizer:
-    def __init__(self, rect:pygame.Rect, song_data:np.ndarray, sample_rate:int):
-        self.rect = rect
-        self.sample_rate = sample_rate
+        self.sample_rate = analysis.sample_rate
+
+        # stft band frames are already calculated by the analysis
+        self.freq_bands = analysis.freq_bands
+        self.amount_windows = analysis.amount_windows
+        self.eq_data_raw = analysis.eq_frames
+        self.channel_eq_data_raw = analysis.channel_eq_frames
+        self.stereo = Sizes.stereo # mirrored left/right bars, only for stereo songs
+
+        self.calc_levels()
+        super().__init__(rect)
+
+    def render_background(self) -> pygame.Surface:
+        background = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        background.fill(Colors.background_music_elements)
+        return background
+
+    def show_stereo(self) -> bool:
+        return self.stereo and self.channel_eq_data_raw is not None
+
+    def bar_frames(self) -> np.ndarray:
+        """ band magnitudes per bar, in stereo the left channel goes on the left half with its low bands in the middle
+        and the right channel on the right half, every bar shows the louder of two neighbouring bands """
+        if not self.show_stereo():
+            return self.eq_data_raw
+        half = Sizes.amount_bars // 2
+        left, right = (channel[:, :2*half].reshape(-1, half, 2).max(axis=2) for channel in self.channel_eq_data_raw)
+        return np.concatenate((left[:, ::-1], right), axis=1, dtype=float) # pygame only takes float64 positions
+
+    def set_stereo(self, stereo:bool):
+        self.stereo = stereo
+        self.calc_levels()
+        self.resize(self.rect)
 
-        # fft constants
-        self.freq_bands = np.geomspace(Sizes.fft_low_freq, Sizes.fft_high_freq, Sizes.amount_bars)
-        self.amount_windows = (len(song_data) - Sizes.fft_window_size) // Sizes.fft_hop_size + 1
-        bin_freqs = np.fft.rfftfreq(Sizes.fft_window_size, 1/sample_rate)
-        target_bins = [np.argmin(np.abs(bin_freqs - f)) for f in self.freq_bands]
-        self.eq_data_raw = np.zeros((self.amount_windows, len(self.freq_bands)))
-        #factor = np.linspace(0.1,1,Sizes.amount_bars)
-        factor = np.logspace(0.1,1,Sizes.amount_bars)
+    def calc_levels(self):
+        """ bar heights and peak markers as 0..1 for every frame, the same for every size so only done once per song and mode
+        smoothing and peaks are worked out for the whole song up front, so any frame draws the same no matter what was drawn before """
+        levels = np.log10(self.bar_frames() + 1e-10) # log that bish
+        levels = np.clip(levels / np.max(levels),0,1) # normalize, scaled to the height while drawing
+        hop_time = Sizes.fft_hop_size / self.sample_rate
+        self.eq_data = smooth_levels(levels, hop_time)
+        self.eq_peaks = peak_levels(self.eq_data, hop_time)
 
+    def view_key(self) -> tuple:
+        return self.rect.size, self.show_stereo() # the amount of bars differs in stereo
 
-        # calculate fft
-        for i in range(self.amount_windows):
-            start = i * Sizes.fft_hop_size
-            end = start + Sizes.fft_window_size
-            window = song_data[start:end] * np.blackman(Sizes.fft_window_size)
-            fft = np.fft.rfft(window)
-            self.eq_data_raw[i,:] = np.abs(fft[target_bins]) * factor
+    def make_view(self) -> dict:
+        amount_bars = self.eq_data.shape[1]
+        bar_width = self.rect.width / amount_bars * (1 - Sizes.bar_padding)
+        x_positions = np.linspace(0, self.rect.width-bar_width, amount_bars, dtype=int)
+        return {"background": self.render_background(), "bar_width": bar_width, "bar_radius": bar_width / 2, "x_positions": x_positions}
 
-        self.resize(self.rect)
+    def frame_index(self, position:float) -> int:
+        return min(int(position * self.sample_rate / Sizes.fft_hop_size), self.amount_windows-1)
 
-    def render_background(self):
-        self.background = pygame.Surface(self.rect.size, pygame.SRCALPHA)
-        self.background.fill(Colors.background_music_elements)
+    def frame_state(self, position:float) -> tuple:
+        return self.frame_index(position),
 
-    def resize(self, rect:pygame.Rect):
-        self.rect = rect
-        self.eq_data = np.log10(self.eq_data_raw + 1e-10) # log that bish
-        self.eq_data = np.clip(self.eq_data / np.max(self.eq_data),0,1) * rect.height # normalize and scale to surface
-        self.bar_width = rect.width / Sizes.amount_bars * (1 - Sizes.bar_padding)
-        self.bar_radius = self.bar_width / 2
-        self.x_positions = np.linspace(0, rect.width-self.bar_width, Sizes.amount_bars, dtype=int)
-        self.render_background()
-
-    def draw(self, position:float) -> tuple[pygame.Surface, tuple[int,int]]:
-        surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
-        surface.blit(self.background, (0,0))
-        frame_index = min(int(position * self.sample_rate / Sizes.fft_hop_size), self.amount_windows-1)
-        eq_data = self.eq_data[frame_index]
+    def draw_frame(self, surface:pygame.Surface, position:float):
+        frame_index = self.frame_index(position)
+        eq_data = self.eq_data[frame_index] * self.rect.height
 
         for x, val in zip(self.x_positions, eq_data):
             pygame.draw.circle(surface, Colors.bar_bright, (x+self.bar_radius,val), self.bar_radius)
             pygame.draw.rect(surface, Colors.bar_bright, (x,0,self.bar_width,val))
 
-        return surface, self.rect.topleft
-    
-    def copy(self, rect:pygame.Rect):
-        new_eq = object.__new__(Equalizer)
-        new_eq.sample_rate = self.sample_rate
-        new_eq.freq_bands = self.freq_bands.copy()
-        new_eq.amount_windows = self.amount_windows
-        new_eq.eq_data_raw = self.eq_data_raw.copy()
-        new_eq.rect = rect
-        new_eq.resize(rect)
-        return new_eq
+        if self.eq_peaks is not None: # just past the round end of the bars
+            thickness = max(1, int(Sizes.eq_peak_thickness * self.rect.height))
+            for x, val in zip(self.x_positions, self.eq_peaks[frame_index] * self.rect.height + self.bar_radius):
+                pygame.draw.rect(surface, Colors.eq_peak, (x,val,self.bar_width,thickness))
+
+class Spectrogram(Element):
+    """ scrolling strip of the equalizer band frames, newest frame at the right edge
+    keeps a ring buffer with one column block per fft frame, draw only colors the frames that came in since the last draw
+    and shows the buffer with two blits, so the cost per frame doesnt grow with the width of the strip """
+    name = "spectrogram"
+    position = "spectrogram"
+    per_clip = True # the ring buffer follows the frames one clip draws
+
+    def __init__(self, rect:pygame.Rect, song:PreparedSong) -> None:
+        analysis = song.analysis
+        self.sample_rate = analysis.sample_rate
+        self.amount_windows = analysis.amount_windows
+        self.eq_data_raw = analysis.eq_frames
+        self.log_max = np.max(np.log10(self.eq_data_raw + 1e-10)) # same normalization as the equalizer
+        stops = np.array([tuple(color)[:3] for color in Colors.spectrogram], dtype=float)
+        steps = np.linspace(0, 1, len(stops))
+        self.colormap = np.stack([np.interp(np.linspace(0, 1, 256), steps, stops[:, c]) for c in range(3)], axis=1).astype(np.uint8)
+        super().__init__(rect)
+
+    def make_view(self) -> dict:
+        column_width = max(1, round(self.rect.width / Sizes.spectrogram_frames))
+        height = max(self.rect.height, 1)
+        return {
+            "column_width": column_width,
+            "amount_columns": -(-self.rect.width // column_width), # frames visible at once
+            "row_bands": (np.arange(height)[::-1] * self.eq_data_raw.shape[1]) // height, # low bands at the bottom
+        }
+
+    def on_resize(self):
+        self.buffer = pygame.Surface((self.amount_columns * self.column_width, max(self.rect.height, 1)))
+        self.buffer.set_alpha(Sizes.spectrogram_alpha)
+        self.last_frame:int|None = None # newest frame in the buffer
+
+    def frame_index(self, position:float) -> int:
+        return min(int(position * self.sample_rate / Sizes.fft_hop_size), self.amount_windows-1)
+
+    def frame_state(self, position:float) -> tuple:
+        return self.frame_index(position),
+
+    def write_frames(self, frames:np.ndarray):
+        """ colors the column blocks of the given frames, frames before the song start stay dark """
+        levels = np.log10(self.eq_data_raw[np.maximum(frames, 0)] + 1e-10)
+        levels = (np.clip(levels / self.log_max, 0, 1) * 255).astype(np.uint8)
+        levels[frames < 0] = 0
+        colors = self.colormap[levels[:, self.row_bands]] # (frames, rows, rgb)
+        columns = ((frames % self.amount_columns)[:, np.newaxis] * self.column_width + np.arange(self.column_width)).ravel()
+        pixels = pygame.surfarray.pixels3d(self.buffer)
+        pixels[columns] = np.repeat(colors, self.column_width, axis=0)
+        del pixels # unlocks the buffer
+
+    def draw_layers(self, position:float) -> list[tuple[pygame.Surface, tuple[int,int], pygame.Rect]]:
+        frame = self.frame_index(position)
+        if self.last_frame is None or not 0 <= frame - self.last_frame < self.amount_columns: # seeked, everything visible is new
+            self.write_frames(np.arange(frame - self.amount_columns + 1, frame + 1))
+        elif frame > self.last_frame:
+            self.write_frames(np.arange(self.last_frame + 1, frame + 1))
+        self.last_frame = frame
+
+        # the oldest visible column is right after the newest frame, the part from there to the buffer end comes first
+        buffer_width = self.buffer.width
+        end = (frame + 1) % self.amount_columns * self.column_width
+        start = (end - self.rect.width) % buffer_width
+        first = min(buffer_width - start, self.rect.width)
+        return [
+            (self.buffer, self.rect.topleft, pygame.Rect(start, 0, first, self.rect.height)),
+            (self.buffer, (self.rect.left + first, self.rect.top), pygame.Rect(0, 0, self.rect.width - first, self.rect.height)),
+        ]
+
+for element_type in (SoundWave, ScrubBar, Equalizer, Spectrogram):
+    register_element(element_type)
@@ -0,0 +1,145 @@
+""" plays a long synthetic track through a simulated mixer and checks the PlaybackClock against the samples actually heard
+
+run with `python -m scripts.clock_check`, exits with 1 when the clock drifts further than the bound or runs backwards
+"""
+import sys
+import math
+import random
+import argparse
+
+from .const import Sizes
+from .audio_elements import PlaybackClock
+
+class SimulatedMixer:
+    """ mixer_music as pygame-ce 2.5 counts it, with the song frames of every delivered buffer kept as sample accurate reference
+
+    the device asks for a buffer every mixer_buffer samples of its own clock (which runs `ppm` off the tick clock), the callback answers up to `jitter` seconds late
+    and the buffer starts playing `jitter` after it was asked for, so one buffer sits in the device like the clock assumes
+    """
+    def __init__(self, rate:int, buffer:int, jitter:float, ppm:float, seed:int) -> None:
+        self.rate = rate
+        self.buffer = buffer
+        self.jitter = jitter
+        self.device_rate = rate * (1 + ppm / 1e6)
+        self.random = random.Random(seed)
+        self.paused = False
+        self.read_pos = 0               # next song frame the callback mixes in
+        self.delivered = 0              # song frames handed to the device, what get_pos counts
+        self.pos_time = 0               # sdl ticks of the last callback
+        self.buffers:list[tuple[int, int]] = [] # first song frame and song frames per buffer, paused buffers are silence
+        self.next_callback = self.callback_time(0)
+
+    def callback_time(self, index:int) -> float:
+        return index * self.buffer / self.device_rate + self.random.uniform(0, self.jitter)
+
+    def advance(self, t:float):
+        """ runs every callback up to t """
+        while self.next_callback <= t:
+            frames = 0 if self.paused else self.buffer
+            self.buffers.append((self.read_pos, frames))
+            if not self.paused:
+                self.read_pos += frames
+                self.delivered += frames
+                self.pos_time = int(self.next_callback * 1000)
+            self.next_callback = self.callback_time(len(self.buffers))
+
+    def get_pos(self, t:float) -> int:
+        ms = 1000 * self.delivered // self.rate
+        return ms if self.paused else ms + int(t * 1000) - self.pos_time
+
+    def pause(self):
+        self.paused = True
+
+    def unpause(self, t:float):
+        self.paused = False
+        self.pos_time = int(t * 1000)
+
+    def play(self, seconds:float, t:float):
+        """ mixer_music.play(start=seconds), which is how MusicPlayer seeks """
+        self.read_pos = round(seconds * self.rate)
+        self.delivered = 0
+        self.pos_time = int(t * 1000)
+        self.paused = False
+
+    def heard(self, t:float) -> float|None:
+        """ song position coming out of the speaker at t, None while only silence plays """
+        played = (t - self.jitter) * self.device_rate
+        index = math.floor(played / self.buffer)
+        if index < 0 or index >= len(self.buffers):
+            return None
+        first, frames = self.buffers[index]
+        if frames == 0:
+            return None
+        return (first + min(played - index * self.buffer, frames)) / self.rate
+
+def run(duration:float, fps:float, jitter:float, ppm:float, seed:int) -> dict:
+    rate = 44100
+    mixer = SimulatedMixer(rate, Sizes.mixer_buffer, jitter, ppm, seed)
+    t = 0.
+    clock = PlaybackClock(lambda: mixer.get_pos(t), Sizes.mixer_buffer / rate, lambda: t)
+    frame_random = random.Random(seed + 1)
+
+    playing = True
+    settle_until = 0.               # old buffers still play right after a seek or resume
+    max_drift = 0.
+    backwards = 0
+    checked = 0
+    last = 0.
+    next_seek, next_pause = 300., 420.
+
+    while t < duration:
+        t += frame_random.uniform(0.5, 1.5) / fps # frames dont come evenly either
+        mixer.advance(t)
+        estimate = clock.position(playing)
+
+        if playing:
+            if estimate < last:
+                backwards += 1
+            heard = mixer.heard(t)
+            if t >= settle_until and heard is not None:
+                max_drift = max(max_drift, abs(estimate - heard))
+                checked += 1
+        last = estimate
+
+        if t >= next_pause:
+            if playing:
+                mixer.pause()
+                next_pause = t + 3
+            else:
+                mixer.unpause(t)
+                settle_until = t + 2 * Sizes.mixer_buffer / rate + jitter
+                next_pause = t + 420
+            playing = not playing
+        elif playing and t >= next_seek:
+            target = frame_random.uniform(0, duration * 0.9)
+            mixer.play(target, t)
+            clock.seek(target)
+            last = target
+            settle_until = t + 2 * Sizes.mixer_buffer / rate + jitter
+            next_seek = t + 300
+
+    return {"max_drift": max_drift, "backwards": backwards, "checked": checked, "wall_drift": clock.wall_drift, "max_held": clock.max_held, "time": t}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--minutes", type=float, default=60, help="length of the synthetic track")
+    parser.add_argument("--fps", type=float, default=Sizes.preview_fps)
+    parser.add_argument("--jitter-ms", type=float, default=5, help="how late the audio callback may answer")
+    parser.add_argument("--ppm", type=float, default=150, help="how much faster the sound card runs than the tick clock")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    jitter = args.jitter_ms / 1000
+    result = run(args.minutes * 60, args.fps, jitter, args.ppm, args.seed)
+    bound = jitter + 0.002 # callbacks answering late plus get_pos and the sdl ticks counting whole ms
+
+    print(f"played {result['time']/60:.1f} min, {result['checked']} positions checked against the heard samples")
+    print(f"max drift {result['max_drift']*1000:.2f}ms (bound {bound*1000:.2f}ms), held at most {result['max_held']*1000:.2f}ms, ran backwards {result['backwards']} times")
+    print(f"a wall clock started at the last seek or resume would be off by {result['wall_drift']*1000:.0f}ms")
+
+    if result["max_drift"] > bound or result["backwards"]:
+        print("clock check failed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,11 @@ class Colors:
     text_background = pygame.Color("#5A149C")           # background for textfield, only used for current, start and end pos controls
     checkbox_border = pygame.Color(100,100,100,100)     # border color for checkbox
     checkbox_checkmark = pygame.Color("white")          # color of the checkmark
+    highlight = pygame.Color(191,127,15,120)            # suggested clips on the scrubbar
+    highlight_selected = pygame.Color(191,127,15,220)   # the suggested clip thats currently used as start/end
+    clip = pygame.Color(90,20,156,220)                  # clips queued for a batch render, bottom of the scrubbar
+    eq_peak = pygame.Color(191,127,15,220)              # falling peak markers of the equalizer
+    spectrogram = pygame.Color("#000000"), pygame.Color("#5A149C"), pygame.Color("#BF7F0F"), pygame.Color("#EEEEEE") # colormap of the spectrogram, quiet to loud
 
 
 @dataclass
@@ -40,6 +45,13 @@ class Paths:
     images = Path(resource_path("tmp/images"))                      # temporary images to be stiched together by ffmpeg
     tmp_audio = Path(resource_path("tmp/audio/faded_audio.wav"))    # temporary audio file that has start and end faded
     video_output = Path(resource_path("tmp/output"))                # output folder of the rendered videos
+    clip_audio = Path(resource_path("tmp/audio/clip_audio.m4a"))    # trimmed, faded and encoded audio of the rendered clip
+    segments = Path(resource_path("tmp/segments"))                  # video segments of the parallel encode
+    frame_cache = Path(resource_path("tmp/frame_cache"))            # rendered frames kept between renders, see FrameCache
+    library = Path(resource_path("tmp/library.sqlite"))             # index of the music library
+    song_cache = Path(resource_path("tmp/song_cache"))              # decoded and analysed songs from the watch folder
+    pcm_cache = Path(resource_path("tmp/pcm_cache"))                # decoded compressed songs as float32 wav, see scripts/pcm_cache.py
+    trace = Path(resource_path("tmp/trace.json"))                   # chrome trace of loading and rendering, see Sizes.trace
 
 
 @dataclass
@@ -56,12 +68,20 @@ class Sizes:
     window_max_size = 900       # set preview window to constant size depending on render size
     window_max_ratio = 0.35     # max screen ratio
     window_render = 1080, 2400  # render window size
+    render_targets = [(1080, 1920), (1080, 1080), (1920, 1080)] # resolutions rendered in one go with shift+R (9:16, 1:1, 16:9)
     blur_radius = 10            # gaussian image blur radius
+    cover_animation_max_mb = 256 # memory for the frames of an animated cover at one size, longer animations skip frames
     background_fade = 0.2       # factor of element height
     soundwave_height = 0.1      # factor of winheight
     soundwave_samples = 500     # amount of samples in the window
     scrubbar_height = 0.05      # factor of winheight
     equalizer_height = 0.1      # factor of winheight
+    spectrogram_height = 0.06   # factor of winheight, strip right below the soundwave
+    spectrogram_frames = 400    # fft frames visible in the spectrogram, about 9s with the default hop size
+    spectrogram_alpha = 200     # transparency of the spectrogram over the cover
+    resize_debounce = 0.25      # seconds without another resize request before the window actually gets resized
+    view_cache_sizes = 4        # sizes every element keeps its backgrounds and layout for, switching back to one is instant
+    stereo = False              # mirrored left/right equalizer and a soundwave trace per channel for stereo songs, S toggles it
     render_framerate = 60       # fps for rendered video
     fft_window_size = 10000     # amount of samples
     fft_hop_size = 1024         # amount of samples
@@ -70,12 +90,81 @@ class Sizes:
     song_fade_time = 1          # amount of seconds used for fading music
     amount_bars = 100           # amount of bars for eq and scrub bar
     bar_padding = 0.15          # ratio of barwidth / gap
+    eq_attack = 0.02            # seconds the equalizer bars take to rise to a new level, 0 jumps right to it
+    eq_release = 0.25           # seconds for the equalizer bars to fall by two thirds, 0 drops them right away
+    eq_peak_hold = 0.6          # seconds the peak markers stay at the highest level before falling
+    eq_peak_fall = 1.5          # bar heights per second the peak markers fall, 0 hides them
+    eq_peak_thickness = 0.03    # factor of equalizer height
     text_selection_radius = 3   # edge radius for selection rect in TextField
     checkbox_width = 2          # width of the rect for checkbox
     checkbox_radius = 3         # radius of the rect for checkbox
     meta_tag_padding = 5        # amount of pixels in x bewteen text and checkbox
     meta_tag_margin = 4         # amount of pixels arround textfield for fading
     clipper_svg = 0.2           # ratio of svg size (square) / soundwave_surface height
+    clipping_threshold = 0.99   # absolute sample value that counts as clipping
+    analysis_block_hops = 64    # amount of fft hops per block the analysis walks through the song with
+    true_peak_oversampling = 4  # oversampling factor for true peak measurement
+    true_peak_taps = 12         # filter taps per oversampling phase
+    frame_cache = False         # keep rendered frames and reuse them when exactly the same frames get rendered again, see FrameCache
+    frame_cache_max_mb = 4096   # size limit of the frame cache on disk
+    pcm_cache_max_mb = 4096     # size limit of the decoded songs on disk, about 10 songs of 4 minutes
+    song_cache_max_mb = 1024    # size limit of the prepared songs (downmix, analysis, covers) on disk
+    pcm_block_frames = 65536    # samples decoded at once while filling the pcm cache
+    library_thumbnail = 64      # size of the cover thumbnails stored in the library
+    library_workers = 0         # processes reading tags while scanning the library, 0 uses all cores
+    library_chunksize = 64      # files handed to a worker at once
+    library_batch = 500         # rows written to the library per transaction
+    library_results = 200       # max amount of tracks listed in the library browser
+    watch_interval = 2          # seconds between two looks at the watch folders
+    watch_debounce = 5          # seconds a file has to stay unchanged before its prepared, so half copied files are skipped
+    watch_workers = 2           # max songs prepared at the same time
+    prefetch_songs = 2          # queued songs decoded and analysed in the background while the current one plays
+    prefetch_budget_mb = 1024   # max memory the prefetched songs may hold, the ones that dont fit get loaded when opened
+    mixer_buffer = 512          # samples per audio callback, smaller means less latency but more risk of crackling
+    scrub_grain = 0.08          # seconds of audio played per scrub grain
+    scrub_fade = 0.005          # seconds of fade at both ends of a grain
+    highlight_length = 15       # seconds of the suggested clips
+    highlight_amount = 3        # amount of suggested clips shown on the scrubbar
+    highlight_step = 4          # fft hops pooled into one possible clip start
+    highlight_context = 2       # seconds before and after a clip start compared for novelty
+    highlight_weights = 1, .5, 1  # weight of energy, spectral flux and novelty in the highlight score
+    highlight_marker = 0.15     # factor of scrubbar height, marker strip at the top of the scrubbar
+    memory_report = False       # print rss and tracemalloc numbers per stage of loading and rendering, tracemalloc slows everything down
+    memory_budget_mb = 0        # stop loading or rendering with an error once the process uses more than this, 0 means no limit
+    memory_sample_interval = 0.01 # seconds between rss samples while reporting, catches peaks inside a stage
+    memory_report_min_kb = 64   # smaller arrays are left out of the report
+    trace = False               # record spans of loading and rendering into Paths.trace, main.py --trace turns it on too
+    notice_time = 5             # seconds a message like a failed render stays over the preview
+    element_budget_ms = 4       # the preview prints it once when an element takes longer than this to draw (smoothed)
+
+
+@dataclass
+class Encoding:
+    preset = "medium"           # libx264 preset, faster presets trade filesize for speed
+    crf = 23                    # libx264 constant rate factor, lower is better quality
+    threads = 0                 # threads per ffmpeg process, 0 lets ffmpeg decide (or splits the cores between segments)
+    segments = 1                # amount of parallel ffmpeg processes, 1 encodes everything in one go
+    gop_size = 250              # keyframe interval in frames, segments are always cut on a keyframe
+    audio_bitrate = "128k"      # aac bitrate
+    target_mb = 25              # size in MB the M key renders to, the upload limit of most chat apps
+    size_overhead = 0.02        # part of the target size kept free for the container
+    size_attempts = 3           # second passes with a lower bitrate before giving up on a too big output
+    min_bitrate = 100           # kbit/s, target sizes that leave less for the video are refused
+
+
+@dataclass
+class Draft:
+    framerate = 30              # fps for draft renders
+    preset = "ultrafast"        # libx264 preset for draft renders
+    crf = 28                    # draft quality, a bit worse is fine for checking timing and layout
+
+
+@dataclass
+class Service:
+    host = "127.0.0.1"          # render service only listens locally by default
+    port = 8765                 # port of the render service
+    workers = 2                 # render worker processes
+    warm_songs = 4              # analysed songs every worker keeps around for the next job
 
 
 @dataclass
@@ -86,12 +175,13 @@ class SVGs:
 @dataclass
 class AllowedFileTypes:
     audio = {".mp3", ".wav", ".flac", ".opus"}          # only these really work with pygame.mixer_music without too much hassle
-    image = {".bmp", ".gif", ".jpeg", ".jpg", ".png"}   # used to load cover art seperately
+    image = {".bmp", ".gif", ".jpeg", ".jpg", ".png", ".webp"} # used to load cover art seperately, gif, webp and png can be animated
 
 
 class Positions(TypedDict):
     soundwave: pygame.Rect                  # soundwave.__init__ wants a rect
     eqalizer: pygame.Rect                   # equalizer.__init__ wants a rect
+    spectrogram: pygame.Rect                # spectrogram.__init__ wants a rect
     scrubbar: pygame.Rect                   # scrubbar.__init__ wants a Rect
     current_time_textfield: pygame.Vector2  # any textfield takes tuple[int,int] or Vector2
     start_fade_textfield: pygame.Vector2
@@ -0,0 +1,133 @@
+""" base class and registry of the visuals drawn over the cover, the orchester only talks to them through Element
+
+a new visualizer subclasses Element, sets name and position, fills in make_view, frame_state and draw_frame and
+calls register_element. it then gets the per size view cache, the redraw skipping, the frame cache key, the draw spans
+and timing and the copies for render targets like the built in ones
+"""
+import abc
+import copy
+import importlib.util
+import sys
+from pathlib import Path
+from typing import Any
+
+import pygame
+
+from .const import Positions
+from .helpers import cached_view
+
+Blit = tuple # (surface, dest) or (surface, dest, area), whatever pygame.Surface.blits takes
+
+class Element(abc.ABC):
+    """ something drawn over the cover every frame
+
+    name            what the orchester calls it, also the span name in traces
+    position        key of get_element_positions the element sits at, or override place
+    per_clip        has state that differs between clips of one render (start/end, ring buffers), gets its own copy per clip
+    view_key        what the size dependent layers depend on, the size unless the element has modes
+    make_view       the size dependent layers and layout as attributes, made once per view_key and shared by all copies
+    on_resize       size dependent state every copy needs its own of
+    frame_state     everything else the frame depends on, equal states draw equal pixels
+    draw_frame      the per frame part, drawn over self.background. frame_state always runs right before it,
+                    so work done there can be kept for draw_frame
+    """
+    name = ""
+    position = ""
+    per_clip = False
+
+    def __init__(self, rect:pygame.Rect) -> None:
+        self.views:dict[tuple, dict[str, Any]] = {}
+        self.frame:pygame.Surface|None = None # draw_frame draws on this one every frame instead of a new surface
+        self.last_key:tuple|None = None
+        self.last_blits:list[Blit] = []
+        self.resize(rect)
+
+    @classmethod
+    def place(cls, positions:Positions, size:tuple[int,int]) -> pygame.Rect:
+        return positions[cls.position]
+
+    def view_key(self) -> tuple:
+        return self.rect.size,
+
+    def make_view(self) -> dict[str, Any]:
+        return {"background": pygame.Surface(self.rect.size, pygame.SRCALPHA)}
+
+    def on_resize(self):
+        pass
+
+    def resize(self, rect:pygame.Rect):
+        self.rect = rect
+        self.__dict__.update(cached_view(self.views, self.view_key(), self.make_view))
+        self.last_key = None
+        self.on_resize()
+
+    @abc.abstractmethod
+    def frame_state(self, position:float) -> tuple:
+        ...
+
+    def state_key(self, position:float) -> tuple:
+        """ everything draw depends on, two equal keys draw the same pixels """
+        return self.view_key(), self.frame_state(position)
+
+    def draw_frame(self, surface:pygame.Surface, position:float):
+        pass
+
+    def draw_layers(self, position:float) -> list[Blit]:
+        """ background with the frame drawn over it, elements that blit their own layers override this """
+        if self.frame is None or self.frame.get_size() != self.rect.size:
+            self.frame = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        self.frame.fill((0,0,0,0))
+        self.frame.blit(self.background, (0,0))
+        self.draw_frame(self.frame, position)
+        return [(self.frame, self.rect.topleft)]
+
+    def draw(self, position:float) -> list[Blit]:
+        """ blits for the window, only drawn again if the state changed since the last frame (paused, slow bars, ...) """
+        key = self.state_key(position)
+        if key != self.last_key:
+            self.last_blits = self.draw_layers(position)
+            self.last_key = key
+        return self.last_blits
+
+    def reset_copy(self):
+        """ state a copy for the render shouldnt take over """
+        pass
+
+    def copy(self, rect:pygame.Rect) -> "Element":
+        """ the element at another size, the song data, levels and view cache are shared instead of copied """
+        new = copy.copy(self)
+        new.frame = None
+        new.last_blits = []
+        new.reset_copy()
+        new.resize(rect)
+        return new
+
+    def __getstate__(self) -> dict:
+        """ surfaces cant be pickled, they all come from the size and resize makes them again after unpickling
+        memory mapped song data ends up in the pickle as a plain array """
+        skipped = {"views", "frame", "last_key", "last_blits"}
+        return {key: value for key, value in self.__dict__.items() if key not in skipped and not isinstance(value, pygame.Surface)}
+
+    def __setstate__(self, state:dict):
+        self.__dict__.update(state)
+        self.views = {}
+        self.frame = None
+        self.last_blits = []
+        self.resize(self.rect)
+
+
+element_types:list[type[Element]] = [] # every orchester makes one of each when a song is set, drawn in this order
+
+def register_element(element_type:type[Element]) -> type[Element]:
+    """ adds the element to every song opened afterwards, works as class decorator """
+    if element_type not in element_types:
+        element_types.append(element_type)
+    return element_type
+
+def load_element_module(path:Path):
+    """ imports a python file that registers its own elements, for visualizers that live outside this repo """
+    from . import audio_elements # built in elements register first, so loaded ones draw on top of them
+    spec = importlib.util.spec_from_file_location(path.stem, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module # pickle finds the element classes by module name
+    spec.loader.exec_module(module)
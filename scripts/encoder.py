@@ -0,0 +1,177 @@
+import os
+import time
+import threading
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+from .const import Paths, Sizes, Encoding, Draft
+from .tracing import tracer, run
+
+def framerate(draft:bool) -> int:
+    return Draft.framerate if draft else Sizes.render_framerate
+
+def video_args(threads:int, draft:bool, bitrate:int|None = None) -> list[str]:
+    """ libx264 arguments shared by the single, segmented and two pass encode, constant quality unless a bitrate in kbit/s is given """
+    quality = ["-b:v", f"{bitrate}k"] if bitrate else ["-crf", str(Draft.crf if draft else Encoding.crf)]
+    return [
+        "-c:v", "libx264", "-pix_fmt", "yuv420p",
+        "-preset", Draft.preset if draft else Encoding.preset,
+        *quality,
+        "-threads", str(threads),
+        "-g", str(Encoding.gop_size),
+        "-r", str(framerate(draft)),
+    ]
+
+def image_input(images_dir:Path, start_number:int = 0, draft:bool = False) -> list[str]:
+    return [
+        "-framerate", str(framerate(draft)),
+        "-start_number", str(start_number),
+        "-i", str(images_dir)+r"/%05d.bmp",
+    ]
+
+def encode_audio(clip:np.ndarray, sample_rate:int, out_path:Path|None = None) -> Path:
+    """ encodes the already trimmed and faded samples of the clip (see fade_clip) once, so they can be muxed without reencoding
+    the samples go to ffmpeg as raw float32 through a pipe, the song file isnt opened again """
+    out_path = out_path or Paths.clip_audio
+    if out_path.exists(): # same selection of the same song rendered before
+        return out_path
+    clip = np.ascontiguousarray(clip, np.float32)
+    partial = out_path.with_stem(f"{out_path.stem}.{os.getpid()}.{threading.get_ident()}.tmp") # other renders might encode the same clip meanwhile
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "f32le", "-ar", str(sample_rate), "-ac", str(clip.shape[1] if clip.ndim > 1 else 1),
+        "-i", "pipe:0",
+        "-vn", "-c:a", "aac", "-b:a", Encoding.audio_bitrate,
+        str(partial)
+    ]
+    run(cmd, f"ffmpeg audio {out_path.name}", memoryview(clip).cast("B"))
+    os.replace(partial, out_path)
+    return out_path
+
+def encode_video(total_frames:int, audio_path:Path, out_path:Path, images_dir:Path = Paths.images, draft:bool = False, target_mb:float = 0):
+    """ encodes all frames with one ffmpeg process, or splits them into segments if Encoding.segments > 1
+    with a target_mb the video gets encoded in two passes to end up just below that size instead """
+    if target_mb:
+        encode_to_size(total_frames, audio_path, out_path, target_mb, images_dir, draft)
+        return
+
+    amount_segments = min(Encoding.segments, -(-total_frames // Encoding.gop_size))
+    if amount_segments > 1:
+        encode_segmented(total_frames, amount_segments, audio_path, out_path, images_dir, draft)
+        return
+
+    cmd = [
+        "ffmpeg", "-y",
+        *image_input(images_dir, 0, draft),
+        "-i", str(audio_path),
+        *video_args(Encoding.threads, draft),
+        "-c:a", "copy",
+        str(out_path)
+    ]
+    print(f"ffmpeg command:\n{' '.join(cmd)}")
+    run(cmd, f"ffmpeg video {out_path.name}")
+
+def encode_segmented(total_frames:int, amount_segments:int, audio_path:Path, out_path:Path, images_dir:Path = Paths.images, draft:bool = False):
+    """ encodes gop aligned frame ranges with parallel ffmpeg processes and joins them with the concat demuxer """
+    segments_dir = Paths.segments / images_dir.name
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    threads = Encoding.threads or max(1, (os.cpu_count() or 1) // amount_segments)
+
+    # every segment is a whole number of gops, so each one starts with a keyframe and concat needs no reencode
+    gops = -(-total_frames // Encoding.gop_size)
+    gop_edges = [round(i * gops / amount_segments) for i in range(amount_segments + 1)]
+    frame_edges = [min(g * Encoding.gop_size, total_frames) for g in gop_edges]
+
+    processes:list[subprocess.Popen] = []
+    start = time.perf_counter()
+    segment_paths:list[Path] = []
+    for i, (first, last) in enumerate(zip(frame_edges[:-1], frame_edges[1:])):
+        segment_path = segments_dir / f"{i:03d}.mkv"
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            *image_input(images_dir, first, draft),
+            "-frames:v", str(last - first),
+            *video_args(threads, draft),
+            "-an", str(segment_path)
+        ]
+        processes.append(subprocess.Popen(cmd))
+        segment_paths.append(segment_path)
+
+    print(f"encoding {amount_segments} segments with {threads} threads each")
+    failed = []
+    for i, p in enumerate(processes):
+        if p.wait() != 0:
+            failed.append(p.args)
+        if tracer.enabled: # waited for in order, a segment that finished early shows up as ending with the one before it
+            tracer.process(p.pid, f"ffmpeg segment {i} of {out_path.name}", start, time.perf_counter())
+    if tracer.enabled:
+        tracer.complete("waiting for segments", "encode", start, time.perf_counter())
+    if failed:
+        raise RuntimeError(f"segment encode failed: {failed}")
+
+    concat_list = segments_dir / "concat.txt"
+    concat_list.write_text("".join(f"file '{p.absolute().as_posix()}'\n" for p in segment_paths))
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", str(concat_list),
+        "-i", str(audio_path),
+        "-map", "0:v", "-map", "1:a",
+        "-c", "copy",
+        str(out_path)
+    ]
+    run(cmd, f"ffmpeg concat {out_path.name}")
+
+def size_bitrate(target_bytes:int, audio_bytes:int, duration:float) -> int:
+    """ video bitrate in kbit/s that fills what the audio and container leave of the target size """
+    video_bytes = target_bytes * (1 - Encoding.size_overhead) - audio_bytes
+    bitrate = int(video_bytes * 8 / duration / 1000)
+    if bitrate < Encoding.min_bitrate:
+        raise ValueError(
+            f"{target_bytes / 1024**2:.1f}MB is too small for {duration:.1f}s, the audio alone takes {audio_bytes / 1024**2:.1f}MB "
+            f"and leaves {max(bitrate, 0)}kbit/s for the video (Encoding.min_bitrate is {Encoding.min_bitrate})"
+        )
+    return bitrate
+
+def encode_to_size(total_frames:int, audio_path:Path, out_path:Path, target_mb:float, images_dir:Path = Paths.images, draft:bool = False):
+    """ two pass encode of the drawn frames, both passes read the same images so nothing gets drawn twice
+    the audio is already encoded, so its exact size comes off the budget. if the output still ends up too big
+    the second pass runs again with a lower bitrate, the first pass statistics stay valid for that """
+    target_bytes = int(target_mb * 1024**2)
+    duration = total_frames / framerate(draft)
+    bitrate = size_bitrate(target_bytes, audio_path.stat().st_size, duration)
+    pass_log = Paths.segments / images_dir.name / "x264_pass"
+    pass_log.parent.mkdir(parents=True, exist_ok=True)
+    two_pass = ["-passlogfile", str(pass_log)]
+
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        *image_input(images_dir, 0, draft),
+        *video_args(Encoding.threads, draft, bitrate),
+        "-pass", "1", *two_pass,
+        "-an", "-f", "null", os.devnull,
+    ]
+    print(f"encoding {out_path.name} to {target_mb}MB with {bitrate}kbit/s video")
+    run(cmd, f"ffmpeg first pass {out_path.name}")
+
+    for attempt in range(Encoding.size_attempts):
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            *image_input(images_dir, 0, draft),
+            "-i", str(audio_path),
+            *video_args(Encoding.threads, draft, bitrate),
+            "-pass", "2", *two_pass,
+            "-c:a", "copy",
+            str(out_path)
+        ]
+        run(cmd, f"ffmpeg second pass {out_path.name}")
+        size = out_path.stat().st_size
+        print(f"{out_path.name} is {size / 1024**2:.2f}MB of {target_mb}MB")
+        if size <= target_bytes:
+            return
+        bitrate -= int((size - target_bytes * (1 - Encoding.size_overhead)) * 8 / duration / 1000) # the audio is fixed, the overshoot is in the video
+        if bitrate < Encoding.min_bitrate:
+            break
+    raise RuntimeError(f"cant get {out_path.name} below {target_mb}MB, it is {out_path.stat().st_size / 1024**2:.2f}MB")
@@ -0,0 +1,219 @@
+""" records pygame event streams from the app and replays them headless against an Orchester to measure input latency
+
+record with `python main.py --record session.json`, replay with `python -m scripts.event_replay benchmarks/sessions/edit_clip.json`
+mouse events remember the widget under the cursor by name (see Orchester.input_targets), so sessions survive layout changes
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from .const import Paths, Sizes, AllowedFileTypes
+
+SKIPPED_EVENTS = {"Quit", "WindowClose"} # replaying those would end the benchmark
+
+def event_to_json(event) -> dict|None:
+    """ name and attributes of a pygame event, None if it has attributes json cant hold """
+    import pygame
+    data = {}
+    for key, value in event.dict.items():
+        if isinstance(value, (tuple, list)):
+            value = list(value)
+        if not isinstance(value, (int, float, str, bool, list, type(None))):
+            return None
+        data[key] = value
+    return {"type": pygame.event.event_name(event.type), "dict": data}
+
+def event_from_json(data:dict):
+    """ the pygame event back, None if this pygame version doesnt know the type """
+    import pygame
+    event_type = getattr(pygame, data["type"].upper(), None) # event_name is the constant in camel case
+    if event_type is None:
+        return None
+    return pygame.event.Event(event_type, {k: tuple(v) if isinstance(v, list) else v for k, v in data["dict"].items()})
+
+def is_song_drop(data:dict) -> bool:
+    return data["type"] == "DropFile" and Path(data["dict"].get("file", "")).suffix in AllowedFileTypes.audio
+
+
+class Recorder:
+    """ collects the events of every frame with their time, saved as json when the app closes """
+    def __init__(self, path:Path, window_size:tuple[int,int]) -> None:
+        self.path = path
+        self.window_size = window_size
+        self.song:str|None = None
+        self.start = time.perf_counter()
+        self.frame = 0
+        self.events:list[dict] = []
+        self.pressed:str|None = None # target of the held mouse button, a drag stays on it even when the cursor leaves it
+
+    def record(self, events:list, orchester):
+        """ events of one frame, recorded before the orchester handles them so the targets are the ones they were aimed at """
+        now = time.perf_counter() - self.start
+        for event in events:
+            data = event_to_json(event)
+            if data is None:
+                continue
+            if self.song is None and is_song_drop(data): # the first song is loaded before replaying, not part of the timing
+                self.song = data["dict"]["file"]
+                continue
+            if "pos" in data["dict"]:
+                data.update(self.target(data, orchester))
+            self.events.append({"time": round(now, 4), "frame": self.frame, **data})
+        self.frame += 1
+
+    def target(self, data:dict, orchester) -> dict:
+        """ name of the widget the mouse event is aimed at and where on it as fraction of its size, empty over nothing """
+        pos = data["dict"]["pos"]
+        name = self.pressed
+        rect = orchester.input_targets().get(name) if name else None
+        if rect is None:
+            name, rect = orchester.target_at(pos) or (None, None)
+        if data["type"] == "MouseButtonDown":
+            self.pressed = name
+        elif data["type"] == "MouseButtonUp":
+            self.pressed = None
+        if rect is None:
+            return {}
+        return {"target": name, "at": [round((pos[0] - rect.x) / rect.width, 4), round((pos[1] - rect.y) / rect.height, 4)]}
+
+    def save(self):
+        session = {"window": list(self.window_size), "song": self.song, "fps": Sizes.preview_fps, "events": self.events}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(session, indent=1))
+        print(f"recorded {len(self.events)} events over {self.frame} frames to {self.path}")
+
+
+def synthetic_song(path:Path, seconds:float = 60) -> Path:
+    """ tone bursts over noise, so sessions without a song still exercise every element the same way on every machine """
+    import soundfile as sf
+    if not path.exists():
+        sample_rate = 44100
+        rng = np.random.default_rng(0)
+        t = np.arange(int(seconds * sample_rate)) / sample_rate
+        song = 0.3 * np.sin(2 * np.pi * 220 * t * (1 + (t % 4 > 2))) * (t % 1 < 0.6) + rng.normal(0, 0.05, len(t))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        sf.write(path, np.stack((song, song), axis=1), sample_rate)
+    return path
+
+def retarget(data:dict, orchester) -> dict|None:
+    """ the recorded mouse event moved onto where its widget is now, None if that widget isnt there """
+    if "target" not in data:
+        return data
+    rect = orchester.input_targets().get(data["target"])
+    if rect is None:
+        return None
+    pos = [round(rect.x + data["at"][0] * rect.width), round(rect.y + data["at"][1] * rect.height)]
+    return {**data, "dict": {**data["dict"], "pos": pos}}
+
+def replay(session:dict, song:Path|None = None, realtime:bool = False) -> dict:
+    """ feeds the recorded events frame by frame into a fresh Orchester and times handling and drawing
+    returns per event type latency stats, the events whose handler alone took longer than a frame
+    and the clicks that found nothing to click on (the session doesnt fit the app anymore) """
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    pygame.mixer.pre_init(buffer=Sizes.mixer_buffer)
+    pygame.init()
+    from .orchester import Orchester
+
+    song = song or (Path(session["song"]) if session.get("song") and Path(session["song"]).exists() else synthetic_song(Paths.tmp_audio.with_name("replay_song.wav")))
+    window = pygame.display.set_mode(session["window"], pygame.SRCALPHA)
+    orchester = Orchester(window, song)
+    budget = 1 / session.get("fps", Sizes.preview_fps)
+
+    frames:dict[int, list[dict]] = {}
+    for data in session["events"]:
+        if data["type"] not in SKIPPED_EVENTS:
+            frames.setdefault(data["frame"], []).append(data)
+
+    latencies:dict[str, list[float]] = {}
+    slow:list[dict] = []
+    missed:list[dict] = []
+    start = time.perf_counter()
+    for frame in range(max(frames, default=-1) + 1):
+        events = frames.get(frame, [])
+        if realtime and events: # keep the recorded pacing, playback moves on meanwhile
+            time.sleep(max(0, events[0]["time"] - (time.perf_counter() - start)))
+
+        handled:list[tuple[str, float]] = []
+        for data in events:
+            if is_song_drop(data): # later song changes load the replay song again, recorded paths are rarely around
+                data = {**data, "dict": {**data["dict"], "file": str(song)}}
+            moved = retarget(data, orchester)
+            if moved is None or (data["type"] == "MouseButtonDown" and orchester.target_at(moved["dict"]["pos"]) is None):
+                missed.append({"frame": frame, "event": data["type"], "target": data.get("target"), "pos": data["dict"]["pos"]})
+                if moved is None:
+                    continue
+            data = moved
+            event = event_from_json(data)
+            if event is None:
+                continue
+            name = data["type"]
+            if name == "KeyDown": # shortcuts and typing cost very different things
+                name += f" {pygame.key.name(data['dict'].get('key', 0))}"
+            handle_start = time.perf_counter()
+            orchester.handle_event(event)
+            handle_time = time.perf_counter() - handle_start
+            if handle_time > budget:
+                slow.append({"frame": frame, "event": name, "ms": round(handle_time * 1000, 2)})
+            handled.append((name, handle_start))
+
+        orchester.draw()
+        pygame.display.flip()
+        frame_done = time.perf_counter()
+        for name, handle_start in handled: # from starting to handle the event until the frame showing its effect is done
+            latencies.setdefault(name, []).append(frame_done - handle_start)
+
+    stats = {
+        name: {
+            "count": len(values),
+            "p50": float(np.percentile(values, 50) * 1000),
+            "p95": float(np.percentile(values, 95) * 1000),
+            "p99": float(np.percentile(values, 99) * 1000),
+            "max": float(np.max(values) * 1000),
+        }
+        for name, values in sorted(latencies.items())
+    }
+    return {"budget_ms": budget * 1000, "latency_ms": stats, "over_budget": slow, "missed_clicks": missed}
+
+def print_report(result:dict):
+    print(f"{'event':<24}{'count':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms, event to finished frame)")
+    for name, stats in result["latency_ms"].items():
+        flag = "  !" if stats["p95"] > result["budget_ms"] else ""
+        print(f"{name:<24}{stats['count']:>6}{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['p99']:>9.2f}{stats['max']:>9.2f}{flag}")
+    print(f"{len(result['over_budget'])} handlers took longer than the {result['budget_ms']:.1f}ms frame budget")
+    for slow in result["over_budget"]:
+        print(f"  frame {slow['frame']}: {slow['event']} {slow['ms']}ms")
+    for missed in result["missed_clicks"]:
+        print(f"  frame {missed['frame']}: {missed['event']} at {missed['pos']} hit nothing" + (f", {missed['target']} is gone" if missed["target"] else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="replays recorded sessions and reports input latency")
+    parser.add_argument("sessions", nargs="+", type=Path)
+    parser.add_argument("--song", type=Path, help="song to replay against instead of the recorded one")
+    parser.add_argument("--realtime", action="store_true", help="keep the recorded timing instead of replaying as fast as possible")
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    parser.add_argument("--fail-over-budget", action="store_true", help="exit with 1 if any handler took longer than a frame")
+    args = parser.parse_args()
+
+    results = {}
+    for path in args.sessions:
+        print(f"replaying {path}")
+        results[str(path)] = replay(json.loads(path.read_text()), args.song, args.realtime)
+        print_report(results[str(path)])
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=1))
+    if any(result["missed_clicks"] for result in results.values()):
+        print("clicks hit nothing, the session doesnt match the app anymore, record it again")
+        sys.exit(1)
+    if args.fail_over_budget and any(result["over_budget"] for result in results.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
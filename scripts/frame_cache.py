@@ -0,0 +1,110 @@
+import os
+import shutil
+import hashlib
+from pathlib import Path
+
+import pygame
+
+from .const import Paths, Sizes, Colors
+from .tracing import span
+
+def hash_content(*parts) -> str:
+    """ stable hash over anything with a stable repr, bytes are hashed as they are """
+    sha = hashlib.sha1()
+    for part in parts:
+        sha.update(part if isinstance(part, bytes) else repr(part).encode())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+def hash_file(path:Path) -> str:
+    """ cheap identity of a file, path plus size and modification time """
+    stat = path.stat()
+    return hash_content(str(path.absolute()), stat.st_size, stat.st_mtime_ns)
+
+def hash_cover(cover:Path|bytes|str|None) -> str:
+    if isinstance(cover, (Path, str)):
+        return hash_file(Path(cover))
+    return hash_content(cover)
+
+STYLE_IGNORED = {"window", "window_render", "render_targets", "frame_cache", "frame_cache_max_mb"} # resolution is part of the key anyway
+
+def hash_style() -> str:
+    """ every setting that changes how frames look, so changing any of them invalidates the cache """
+    settings = [
+        (name, value) for cls in (Sizes, Colors) for name, value in vars(cls).items()
+        if not name.startswith("_") and not callable(value) and name not in STYLE_IGNORED
+    ]
+    return hash_content(settings)
+
+
+class FrameCache:
+    """ rendered frames on disk, addressed by a hash of everything that went into drawing them
+    a hit is hardlinked into the render folder, so it skips drawing and saving. only frames that are exactly the same
+    come back (rendering the same clip again, another clip overlapping it with the same start/end and tags), thats why
+    its off unless Sizes.frame_cache is set """
+    def __init__(self, folder:Path|None = None, max_bytes:int|None = None) -> None:
+        self.folder = folder or Paths.frame_cache
+        self.max_bytes = max_bytes or Sizes.frame_cache_max_mb * 1024**2
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.size = 0 # bytes in the folder, counted by evict and kept up to date by store
+        self.evict()
+
+    def path(self, key:str) -> Path:
+        return self.folder / f"{key}.bmp"
+
+    def fetch(self, key:str, destination:Path) -> bool:
+        """ puts the cached frame at destination, returns False if it was never rendered """
+        cached = self.path(key)
+        if not cached.exists():
+            self.misses += 1
+            return False
+        with span("fetch cached frame", "io"):
+            os.utime(cached) # mark as recently used for eviction
+            self.link(cached, destination)
+        self.hits += 1
+        return True
+
+    def store(self, surface:pygame.Surface, key:str, destination:Path):
+        """ saves the frame into the cache and links it to destination, the same single write as saving it there directly """
+        cached = self.path(key)
+        partial = cached.with_name(f"{key}.{os.getpid()}.tmp.bmp") # other processes might fetch the same key meanwhile
+        with span("save frame", "io"):
+            pygame.image.save(surface, partial)
+            self.size += partial.stat().st_size
+            os.replace(partial, cached)
+            self.link(cached, destination)
+        if self.size > self.max_bytes: # while storing, a long render never goes far over the limit
+            self.evict()
+
+    def link(self, cached:Path, destination:Path):
+        try:
+            os.link(cached, destination)
+        except OSError: # filesystem without hardlinks
+            shutil.copyfile(cached, destination)
+
+    def evict(self):
+        """ removes least recently used frames until the cache fits in 90% of max_bytes, so the next frames dont evict again right away
+        frames linked into the render folder stay there, only the cache loses them """
+        files = []
+        for f in self.folder.iterdir():
+            try:
+                files.append((f.stat(), f))
+            except FileNotFoundError: # evicted by another render meanwhile
+                pass
+        self.size = sum(stat.st_size for stat, _ in files)
+        if self.size <= self.max_bytes:
+            return
+        for stat, f in sorted(files, key=lambda x: x[0].st_mtime):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            f.unlink(True)
+            self.size -= stat.st_size
+            self.evicted += 1
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return f"frame cache: {self.hits}/{total} frames reused ({ratio:.0f}%), {self.evicted} evicted, {self.size / 1024**2:.0f}MB on disk"
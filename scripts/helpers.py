@@ -1,11 +1,14 @@
+import shutil
 from io import BytesIO
 from pathlib import Path
+from typing import Callable
+from dataclasses import dataclass
 import numpy as np
 
 import pygame
 import soundfile as sf
 from tinytag import TinyTag
-from PIL import Image, ImageFilter
+from PIL import Image, ImageFilter, ImageSequence
 
 from .const import Paths, Sizes, Colors, Fonts, Positions
 
@@ -36,7 +39,10 @@ def get_metadata(file_path: Path) -> dict:
         "cover_art": image,
     }
 
-def convert_cover(cover:Path|bytes|str|None, size:tuple[int,int]):
+CoverLayers = tuple[pygame.Surface, pygame.Surface] | None # sharp and blurred cover at source resolution, None if theres no cover
+
+def load_cover(cover:Path|bytes|str|None, blur:bool = True) -> CoverLayers:
+    """ decodes and blurs the cover once at its own resolution, compose_cover scales it to any size afterwards """
     if isinstance(cover, bytes):
         image = Image.open(BytesIO(cover))
     elif isinstance(cover, Path):
@@ -44,16 +50,12 @@ def convert_cover(cover:Path|bytes|str|None, size:tuple[int,int]):
     elif isinstance(cover, str):
         image = Image.open(cover)
     elif cover is None:
-        surface = pygame.Surface(size)
-        surface.fill(Colors.background)
-        txt_surface = Fonts.custom(max(size)//20).render("No cover", True, Colors.text, Colors.background)
-        x = (size[0] - txt_surface.width) // 2
-        y = (size[1] - txt_surface.height) // 2
-        surface.blit(txt_surface, (x,y))
-        return surface
+        return None
     else:
         raise TypeError("cover must be raw bytes or path to file")
+    return image_layers(image, blur)
 
+def image_layers(image:Image.Image, blur:bool = True) -> CoverLayers:
     if image.mode == "RGB":
         format = "RGB"
     elif image.mode == "RGBA":
@@ -62,10 +64,58 @@ def convert_cover(cover:Path|bytes|str|None, size:tuple[int,int]):
         image = image.convert("RGB")
         format = "RGB"
 
-    image_blur = image.filter(ImageFilter.GaussianBlur(radius=Sizes.blur_radius))
+    image_blur = image.filter(ImageFilter.GaussianBlur(radius=Sizes.blur_radius)) if blur else image # drafts skip the blur
     image = pygame.image.frombytes(image.tobytes(), image.size, format) #breaks here: ValueError: Bytes length does not equal format and resolution size
     image_blur = pygame.image.frombytes(image_blur.tobytes(), image_blur.size, format)
+    return image, image_blur
+
+def frame_step(amount_frames:int, frame_bytes:int) -> int:
+    """ keep every nth frame so all of them fit in Sizes.cover_animation_max_mb """
+    return max(1, -(-amount_frames * frame_bytes // (Sizes.cover_animation_max_mb * 1024**2)))
+
+@dataclass
+class CoverAnimation:
+    """ frames of an animated cover with the time they start at, looping over the song time """
+    frames: list            # CoverLayers at source resolution, or composed surfaces once scaled to a size
+    starts: np.ndarray      # seconds into the loop each frame starts at
+    duration: float         # seconds of one loop
+
+    def frame_index(self, time_pos:float) -> int:
+        return int(np.searchsorted(self.starts, time_pos % self.duration, "right")) - 1
+
+    def composed(self, size:tuple[int,int]) -> "CoverAnimation":
+        """ every frame composed like compose_cover at the size, so drawing one is a single blit """
+        step = frame_step(len(self.frames), size[0] * size[1] * 4)
+        return CoverAnimation([compose_cover(layers, size) for layers in self.frames[::step]], self.starts[::step], self.duration)
+
+def load_cover_animation(cover:Path, blur:bool = True) -> CoverAnimation|None:
+    """ decodes and blurs every frame of an animated gif, webp or png once, None for still images
+    frames over the memory cap are skipped, the kept ones stay up for the time of the skipped ones """
+    image = Image.open(cover)
+    amount = getattr(image, "n_frames", 1)
+    if amount < 2:
+        return None
+    step = frame_step(amount, image.width * image.height * 4 * 2) # sharp and blurred layer
+    frames, durations = [], []
+    for i, frame in enumerate(ImageSequence.Iterator(image)):
+        durations.append((frame.info.get("duration") or 100) / 1000) # 0 means as fast as possible, browsers use 100ms
+        if i % step == 0:
+            frames.append(image_layers(frame.copy(), blur))
+    starts = np.concatenate(([0], np.cumsum(durations)[:-1]))[::step]
+    return CoverAnimation(frames, starts, sum(durations))
+
+def compose_cover(layers:CoverLayers, size:tuple[int,int]) -> pygame.Surface:
+    """ blurred cover filling the whole size with the sharp cover fitted on top """
+    if layers is None:
+        surface = pygame.Surface(size)
+        surface.fill(Colors.background)
+        txt_surface = Fonts.custom(max(size)//20).render("No cover", True, Colors.text, Colors.background)
+        x = (size[0] - txt_surface.width) // 2
+        y = (size[1] - txt_surface.height) // 2
+        surface.blit(txt_surface, (x,y))
+        return surface
 
+    image, image_blur = layers
     cover_surface = pygame.Surface(size, pygame.SRCALPHA)
     image = resize_surface(image, size, True)
     image_blur = resize_surface(image_blur, size, False)
@@ -74,6 +124,19 @@ def convert_cover(cover:Path|bytes|str|None, size:tuple[int,int]):
 
     return cover_surface
 
+def cached_view(views:dict, key, make:Callable):
+    """ view state for one size, made on first use and kept for the Sizes.view_cache_sizes last used sizes """
+    if key in views:
+        views[key] = views.pop(key) # most recently used goes last
+    else:
+        views[key] = make()
+        while len(views) > Sizes.view_cache_sizes:
+            del views[next(iter(views))]
+    return views[key]
+
+def convert_cover(cover:Path|bytes|str|None, size:tuple[int,int]):
+    return compose_cover(load_cover(cover), size)
+
 def resize_surface(surface:pygame.Surface, size:tuple[int,int], fit:bool):
     """ scales surface, fit:True means it fits in the size result in blackbars(alpha), False means potential cutting"""
     new_surface = pygame.Surface(size, pygame.SRCALPHA) # create new destination surface
@@ -88,34 +151,34 @@ def resize_surface(surface:pygame.Surface, size:tuple[int,int], fit:bool):
     new_surface.blit(surface, (offset_x, offset_y))
     return new_surface
 
-def fade_song(song_data:np.ndarray, sample_rate:int, start:float, end:float):
-    fade_samples = Sizes.song_fade_time * sample_rate
-    fade_in_start = int(start * sample_rate)
-    fade_out_start = int(end * sample_rate - fade_samples)
-    faded_song = song_data.copy()
-    amount_channels = 1
-    if len(song_data.shape) > 1:
-        amount_channels = song_data.shape[1]
-
-    if amount_channels > 1:
-        fade_in = np.linspace(0,1,fade_samples)[:, np.newaxis]
-        fade_out = np.linspace(1,0,fade_samples)[:, np.newaxis]
-        faded_song[:fade_in_start, :] = 0
-        faded_song[fade_out_start+fade_samples:, :] = 0
-        faded_song[fade_in_start:fade_in_start+fade_samples, :] *= fade_in
-        faded_song[fade_out_start:fade_out_start+fade_samples, :] *= fade_out
-    else:
-        fade_in = np.linspace(0,1,fade_samples)
-        fade_out = np.linspace(1,0,fade_samples)
-        faded_song[:fade_in_start] = 0
-        faded_song[fade_out_start+fade_samples:] = 0
-        faded_song[fade_in_start:fade_in_start+fade_samples] *= fade_in
-        faded_song[fade_out_start:fade_out_start+fade_samples] *= fade_out
+def fade_clip(song_data:np.ndarray, sample_rate:int, start:float, end:float) -> np.ndarray:
+    """ float32 copy of the samples from start to end, faded in and out over Sizes.song_fade_time
+    the ramps are linear in time like the fade from/to black of the rendered frames, so audio and video fade together """
+    first = round(start * sample_rate)
+    clip = np.array(song_data[first : round(end * sample_rate)], dtype=np.float32)
+    fade_samples = min(int(Sizes.song_fade_time * sample_rate), len(clip) // 2)
+    fade_in = np.linspace(0, 1, fade_samples, dtype=np.float32)
+    if clip.ndim > 1:
+        fade_in = fade_in[:, np.newaxis]
+    clip[:fade_samples] *= fade_in
+    clip[len(clip)-fade_samples:] *= fade_in[::-1]
+    return clip
 
+def fade_song(song_data:np.ndarray, sample_rate:int, start:float, end:float):
+    """ writes the song muted outside of start/end with the clip faded like in the render, for the preview """
+    faded_song = np.zeros(song_data.shape, np.float32)
+    first = round(start * sample_rate)
+    clip = fade_clip(song_data, sample_rate, start, end)
+    faded_song[first : first + len(clip)] = clip
     sf.write(Paths.tmp_audio, faded_song, sample_rate)
 
+def even_size(size:tuple[int,int]) -> tuple[int,int]:
+    """ size rounded down to even width and height, yuv420p halves the chroma so libx264 refuses odd ones """
+    return size[0] - size[0] % 2, size[1] - size[1] % 2
+
 def get_element_positions(winsize: tuple[int, int]) -> Positions:
     soundwave = pygame.Rect(0, 0, winsize[0], Sizes.soundwave_height * winsize[1])
+    spectrogram = pygame.Rect(0, soundwave.bottom, winsize[0], Sizes.spectrogram_height * winsize[1])
     equalizer = pygame.Rect(0, winsize[1] - Sizes.equalizer_height * winsize[1], winsize[0], Sizes.equalizer_height * winsize[1])
     scrubbar = pygame.Rect(0, equalizer.top - Sizes.scrubbar_height * winsize[1], winsize[0], Sizes.scrubbar_height * winsize[1])
     end_fade_textfield = pygame.Vector2(5, scrubbar.top - Fonts.medium.get_height())
@@ -127,6 +190,7 @@ def get_element_positions(winsize: tuple[int, int]) -> Positions:
     return {
         "soundwave": soundwave,
         "eqalizer": equalizer,
+        "spectrogram": spectrogram,
         "scrubbar": scrubbar,
         "current_time_textfield": current_time_textfield,
         "start_fade_textfield": start_fade_textfield,
@@ -135,13 +199,21 @@ def get_element_positions(winsize: tuple[int, int]) -> Positions:
         "resolution_textfield": resolution_textfield
     }
 
+def clear_render_dirs(keep_audio:tuple[Path, ...] = ()):
+    """ removes frames, segments and audio of the last render, except the clip audio this render can reuse """
+    for folder in (Paths.images, Paths.segments):
+        shutil.rmtree(folder, ignore_errors=True)
+        folder.mkdir(parents=True, exist_ok=True)
+    Paths.clip_audio.parent.mkdir(parents=True, exist_ok=True)
+    for audio in Paths.clip_audio.parent.glob(f"{Paths.clip_audio.stem}*{Paths.clip_audio.suffix}"): # batch renders have one per clip
+        if audio not in keep_audio:
+            audio.unlink(True)
+
 def tmp_cleanup():
-    Paths.images.mkdir(parents=True, exist_ok=True)
     Paths.tmp_audio.parent.mkdir(parents=True, exist_ok=True)
     Paths.video_output.mkdir(parents=True, exist_ok=True)
     Paths.tmp_audio.unlink(True)
-    for f in Paths.images.iterdir():
-        f.unlink()
+    clear_render_dirs()
 
 def time_to_str(seconds:float) -> str:
     """ formats a float in seconds to minutes and seconds string """
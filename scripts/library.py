@@ -0,0 +1,203 @@
+import os
+import sqlite3
+import multiprocessing
+import threading
+from io import BytesIO
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from tinytag import TinyTag
+from PIL import Image
+
+from .const import Paths, Sizes, AllowedFileTypes
+
+SCHEMA_VERSION = 2 # bumped when the tracks table changes, older ones get rebuilt by the next scan
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    folder TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    title TEXT,
+    artist TEXT,
+    album TEXT,
+    genre TEXT,
+    date TEXT,
+    duration REAL,
+    sample_rate INTEGER,
+    bitrate REAL
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    path TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tracks_order ON tracks(artist COLLATE NOCASE, title COLLATE NOCASE, path);
+
+-- word prefix search over artist, title and path, kept in sync with tracks by the triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+    artist, title, path, content='tracks', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+);
+CREATE TRIGGER IF NOT EXISTS tracks_insert AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts(rowid, artist, title, path) VALUES (new.rowid, new.artist, new.title, new.path);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_delete AFTER DELETE ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, artist, title, path) VALUES ('delete', old.rowid, old.artist, old.title, old.path);
+    DELETE FROM thumbnails WHERE path = old.path;
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_update AFTER UPDATE ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, artist, title, path) VALUES ('delete', old.rowid, old.artist, old.title, old.path);
+    INSERT INTO tracks_fts(rowid, artist, title, path) VALUES (new.rowid, new.artist, new.title, new.path);
+END;
+"""
+
+TRACK_COLUMNS = ("path", "folder", "mtime_ns", "size", "title", "artist", "album", "genre", "date", "duration", "sample_rate", "bitrate")
+ORDER = "ORDER BY tracks.artist COLLATE NOCASE, tracks.title COLLATE NOCASE, tracks.path"
+
+def make_thumbnail(data:bytes|None) -> bytes|None:
+    """ small png of the cover, so the browser never has to touch the audio file """
+    if not data:
+        return None
+    try:
+        image = Image.open(BytesIO(data)).convert("RGB")
+        image.thumbnail((Sizes.library_thumbnail, Sizes.library_thumbnail))
+        out = BytesIO()
+        image.save(out, "PNG")
+        return out.getvalue()
+    except Exception:
+        return None
+
+def scan_file(job:tuple[str, str, int, int]) -> tuple|None:
+    """ runs in a worker process, reads tags and cover of one file and returns a row for the tracks table plus the thumbnail """
+    path, folder, mtime_ns, size = job
+    try:
+        tag = TinyTag.get(path, image=True)
+    except Exception as e:
+        print("cant read tags of", path, e)
+        return None
+    image = tag.images.any
+    thumbnail = make_thumbnail(image.data if image else None)
+    return (path, folder, mtime_ns, size, tag.title, tag.artist, tag.album, tag.genre, tag.year, tag.duration, tag.samplerate, tag.bitrate, thumbnail)
+
+def connect(db_path:Path) -> sqlite3.Connection:
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL") # lets the ui search while the scanner writes
+    if connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        # tracks of an older version had the thumbnails inline and no search index, the folders stay and get scanned again
+        connection.executescript(f"DROP TABLE IF EXISTS tracks; PRAGMA user_version = {SCHEMA_VERSION};")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class Library:
+    """ sqlite index of audio files in some folders, scanned in the background by a pool of worker processes """
+    def __init__(self, db_path:Path = Paths.library) -> None:
+        self.db_path = db_path
+        self.connection = connect(db_path)
+        self.scanner:threading.Thread|None = None
+        self.scanned = 0    # files checked in the current scan
+        self.indexed = 0    # files (re)read in the current scan
+        self.changed = True # set whenever the scanner committed something, the browser resets it after searching
+
+    @property
+    def scanning(self) -> bool:
+        return self.scanner is not None and self.scanner.is_alive()
+
+    def folders(self, connection:sqlite3.Connection|None = None) -> list[Path]:
+        connection = connection or self.connection
+        return [Path(row[0]) for row in connection.execute("SELECT path FROM folders")]
+
+    def add_folder(self, folder:Path):
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO folders VALUES (?)", (str(folder.absolute()),))
+        self.rescan()
+
+    def rescan(self):
+        """ starts an incremental scan in the background, files with unchanged mtime and size are skipped """
+        if self.scanning:
+            return
+        self.scanner = threading.Thread(target=self.scan, daemon=True)
+        self.scanner.start()
+
+    def scan(self):
+        connection = connect(self.db_path) # sqlite connections cant be shared between threads
+        self.scanned = 0
+        self.indexed = 0
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in connection.execute("SELECT path, mtime_ns, size FROM tracks")}
+        seen = set()
+        jobs = []
+
+        for folder in self.folders(connection):
+            for root, _, files in os.walk(folder):
+                for name in files:
+                    if Path(name).suffix.lower() not in AllowedFileTypes.audio:
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    seen.add(path)
+                    self.scanned += 1
+                    if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                        jobs.append((path, str(folder), stat.st_mtime_ns, stat.st_size))
+
+        removed = [(path,) for path in known.keys() - seen]
+        if removed:
+            with connection:
+                connection.executemany("DELETE FROM tracks WHERE path = ?", removed)
+            self.changed = True
+
+        if jobs:
+            rows = []
+            # spawn instead of fork, forking a process that runs sdl threads is asking for trouble
+            with ProcessPoolExecutor(Sizes.library_workers or None, multiprocessing.get_context("spawn")) as executor:
+                for row in executor.map(scan_file, jobs, chunksize=Sizes.library_chunksize):
+                    self.indexed += 1
+                    if row is not None:
+                        rows.append(row)
+                    if len(rows) >= Sizes.library_batch:
+                        self.insert(connection, rows)
+                        rows = []
+            self.insert(connection, rows)
+
+        connection.close()
+        print(f"library scan done, {self.scanned} files checked, {self.indexed} indexed, {len(removed)} removed")
+
+    def insert(self, connection:sqlite3.Connection, rows:list[tuple]):
+        """ rows as scan_file returns them, an upsert so the search index gets updated instead of deleted and added """
+        columns = ", ".join(TRACK_COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in TRACK_COLUMNS[1:])
+        with connection:
+            connection.executemany(
+                f"INSERT INTO tracks ({columns}) VALUES ({','.join('?'*len(TRACK_COLUMNS))}) ON CONFLICT(path) DO UPDATE SET {updates}",
+                [row[:-1] for row in rows]
+            )
+            connection.executemany("DELETE FROM thumbnails WHERE path = ?", [row[:1] for row in rows if row[-1] is None])
+            connection.executemany("INSERT OR REPLACE INTO thumbnails VALUES (?, ?)", [(row[0], row[-1]) for row in rows if row[-1] is not None])
+        self.changed = True
+
+    def search(self, query:str, limit:int = 100) -> list[tuple[str, str|None, str|None, float|None]]:
+        """ tracks where every word of query starts a word of the artist, title or path, as (path, artist, title, duration) """
+        words = query.split()
+        if not words:
+            return self.connection.execute(f"SELECT path, artist, title, duration FROM tracks {ORDER} LIMIT ?", (limit,)).fetchall()
+        match = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+        return self.connection.execute(
+            f"""SELECT tracks.path, tracks.artist, tracks.title, tracks.duration FROM tracks_fts
+            JOIN tracks ON tracks.rowid = tracks_fts.rowid WHERE tracks_fts MATCH ? {ORDER} LIMIT ?""",
+            (match, limit)
+        ).fetchall()
+
+    def thumbnails(self, paths:list[str]) -> dict[str, bytes]:
+        """ png thumbnails of the tracks that have a cover """
+        placeholders = ",".join("?" * len(paths))
+        return dict(self.connection.execute(f"SELECT path, data FROM thumbnails WHERE path IN ({placeholders})", paths))
+
+    def __len__(self) -> int:
+        """ counts every row, cache it instead of calling it every frame """
+        return self.connection.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
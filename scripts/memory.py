@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from dataclasses import dataclass, fields, is_dataclass
+
+import numpy as np
+
+from .const import Sizes
+from .tracing import tracer
+
+class MemoryBudgetExceeded(MemoryError):
+    pass
+
+def rss() -> int:
+    """ resident memory of this process in bytes, 0 where it cant be read """
+    try:
+        with open("/proc/self/statm") as f: # linux
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in ("PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                                                     "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")
+            ]
+        counters = Counters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return 0
+
+def mb(amount:int) -> str:
+    return f"{amount / 1024**2:.1f}MB"
+
+def array_breakdown(objects:dict[str, object]) -> list[tuple[str, np.ndarray]]:
+    """ every numpy array the objects hold in their attributes (one level deep, plus tuples/lists of arrays), biggest first
+    arrays that share memory with one listed before are left out, so the sizes add up to what is actually allocated """
+    found = []
+    for name, obj in objects.items():
+        if isinstance(obj, np.ndarray):
+            found.append((name, obj))
+            continue
+        if is_dataclass(obj):
+            attributes = {f.name: getattr(obj, f.name) for f in fields(obj)}
+        else:
+            attributes = getattr(obj, "__dict__", {})
+        for attribute, value in attributes.items():
+            values = value if isinstance(value, (tuple, list)) else (value,)
+            for i, array in enumerate(values):
+                if isinstance(array, np.ndarray):
+                    found.append((f"{name}.{attribute}" + (f"[{i}]" if len(values) > 1 else ""), array))
+
+    seen:list[np.ndarray] = []
+    unique = []
+    for name, array in sorted(found, key=lambda x: -x[1].nbytes):
+        owner = array
+        while isinstance(owner.base, np.ndarray): # views point to the array that owns the memory
+            owner = owner.base
+        if any(owner is s for s in seen):
+            continue
+        seen.append(owner)
+        unique.append((name, array))
+    return unique
+
+
+@dataclass
+class StageMemory:
+    name: str
+    seconds: float
+    rss_start: int
+    rss_end: int
+    rss_peak: int           # highest sampled rss during the stage
+    traced: int             # python/numpy allocations still alive at the end of the stage, relative to its start
+    traced_peak: int        # highest python/numpy allocations during the stage, relative to its start
+
+
+class MemoryTracker:
+    """ rss and tracemalloc numbers per stage of loading or rendering, stages start with begin and end with the next one
+    does nothing unless Sizes.memory_report is set, Sizes.memory_budget_mb is above 0 or tracing is on (stages become spans) """
+    def __init__(self, title:str) -> None:
+        self.title = title
+        self.enabled = Sizes.memory_report
+        self.budget = Sizes.memory_budget_mb * 1024**2
+        self.stages:list[StageMemory] = []
+        self.current:tuple[str, float, int, int]|None = None # name, start time, rss and traced memory at the start
+        self.peak = 0
+        self.sampling = False
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def sample(self):
+        """ background thread, catches rss peaks between the stage borders """
+        while self.sampling:
+            self.peak = max(self.peak, rss())
+            time.sleep(Sizes.memory_sample_interval)
+
+    def begin(self, name:str):
+        if not self.enabled and not self.budget and not tracer.enabled:
+            return
+        self.end()
+        current_rss = rss()
+        self.check(name, current_rss)
+        self.peak = current_rss
+        traced = 0
+        if self.enabled:
+            traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            if not self.sampling:
+                self.sampling = True
+                threading.Thread(target=self.sample, daemon=True).start()
+        self.current = name, time.perf_counter(), current_rss, traced
+
+    def end(self):
+        if self.current is None:
+            return
+        name, start, rss_start, traced_start = self.current
+        self.current = None
+        rss_end = rss()
+        if tracer.enabled:
+            tracer.complete(name, "stage", start, time.perf_counter(), {"title": self.title, "rss": mb(rss_end)})
+        traced, traced_peak = tracemalloc.get_traced_memory() if self.enabled else (traced_start, traced_start)
+        self.stages.append(StageMemory(name, time.perf_counter() - start, rss_start, rss_end, max(self.peak, rss_end), traced - traced_start, traced_peak - traced_start))
+        self.check(name, max(self.peak, rss_end))
+
+    def check(self, stage:str, used:int):
+        if self.budget and used > self.budget:
+            self.sampling = False
+            raise MemoryBudgetExceeded(
+                f"{self.title}: {stage} brought the process to {mb(used)}, over the memory budget of {mb(self.budget)} (Sizes.memory_budget_mb)"
+            )
+
+    def finish(self, objects:dict[str, object]|None = None):
+        """ ends the last stage and prints the report if enabled """
+        self.end()
+        self.sampling = False
+        if self.enabled:
+            print(self.report(objects or {}))
+
+    def report(self, objects:dict[str, object]) -> str:
+        lines = [f"memory of {self.title} (rss now {mb(rss())})", f"  {'stage':<28}{'time':>8}{'rss':>11}{'rss peak':>11}{'traced':>11}{'traced peak':>13}"]
+        for stage in self.stages:
+            lines.append(
+                f"  {stage.name:<28}{stage.seconds*1000:>6.0f}ms{mb(stage.rss_end - stage.rss_start):>11}{mb(stage.rss_peak - stage.rss_start):>11}"
+                f"{mb(stage.traced):>11}{mb(stage.traced_peak):>13}"
+            )
+        arrays = array_breakdown(objects)
+        if arrays:
+            lines.append(f"  numpy arrays held, {mb(sum(array.nbytes for _, array in arrays))} in total:")
+            for name, array in arrays:
+                if array.nbytes < Sizes.memory_report_min_kb * 1024:
+                    break
+                kind = " memmap" if isinstance(array, np.memmap) or isinstance(array.base, np.memmap) else ""
+                lines.append(f"    {name:<36}{mb(array.nbytes):>10}  {array.dtype} {array.shape}{kind}")
+        return "\n".join(lines)
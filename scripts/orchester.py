@@ -1,39 +1,98 @@
 import sys
+import copy
+import time
 import subprocess
-import numpy as np
-import soundfile as sf
+from dataclasses import dataclass
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pygame
 
-from .const import Colors, Paths, Sizes, AllowedFileTypes
-from .helpers import get_metadata, time_to_str, str_to_time, convert_cover, fade_song, get_element_positions, tmp_cleanup
-from .ui_elements import CheckBox, MetadataTag, TextField
-from .audio_elements import MusicPlayer, SoundWave, ScrubBar, Equalizer
+from .const import Colors, Fonts, Paths, Sizes, AllowedFileTypes, Encoding, Draft
+from .helpers import time_to_str, str_to_time, cached_view, load_cover, load_cover_animation, compose_cover, CoverLayers, CoverAnimation, fade_song, fade_clip, even_size, get_element_positions, tmp_cleanup, clear_render_dirs
+from .ui_elements import CheckBox, MetadataTag, TextField, LibraryBrowser
+from .audio_elements import MusicPlayer, Scrubber, SoundWave, ScrubBar, Equalizer, Spectrogram
+from .elements import Element, element_types
+from .analysis import SongAnalysis, find_highlights
+from .encoder import encode_audio, encode_video, framerate, size_bitrate
+from .frame_cache import FrameCache, hash_content, hash_file, hash_cover, hash_style
+from .library import Library
+from .song_cache import PreparedSong, load_prepared, prepare_song
+from .song_queue import SongQueue
+from .memory import MemoryTracker, MemoryBudgetExceeded
+from .tracing import tracer, span
+
+@dataclass
+class RenderTarget:
+    """ one video of a render, a clip at a resolution """
+    orchester: "Orchester"
+    fade_surface: pygame.Surface
+    images_dir: Path
+    out_path: Path
+    static_key: str     # everything but the time that goes into a frame
+    clip: int           # index into the rendered clips, they share the audio
+    start: float
+    end: float
+    total_frames: int
 
 class Orchester:
     def __init__(self, window:pygame.Surface, song_path:Path|None = None, render_state=False) -> None:
         self.window = window
         self.song_path = song_path
+        self.audio_path = song_path # decoded wav from the pcm cache for compressed songs, see set_song
         self.render_state = render_state
 
         self.info_surface = window.copy()
         self.cover_surface = window.copy()
         self.cover_raw:Path|bytes|None = None
+        self.cover_layers:CoverLayers = None
+        self.covers:dict[tuple[int,int], pygame.Surface] = {} # composed cover per window size
+        self.cover_animation:CoverAnimation|None = None # frames of an animated cover at source resolution
+        self.cover_frames:CoverAnimation|None = None # the same composed at the window size, only kept for the current size
+        self.pending_size:tuple[int,int]|None = None # resize waiting for Sizes.resize_debounce
+        self.notice:tuple[pygame.Surface, float]|None = None # message drawn over the preview and until when, see show_notice
+        self.resize_requested = 0.
 
         self.music_player:MusicPlayer|None = None
-        self.soundwave:SoundWave|None = None
-        self.scrubbar:ScrubBar|None = None
-        self.equalizer:Equalizer|None = None
+        self.scrubber:Scrubber|None = None
+        self.elements:dict[str, Element] = {} # one of every registered element type, drawn in this order
+        self.element_times:dict[str, float] = {} # smoothed draw time per element in ms, for the preview
+        self.slow_elements:set[str] = set() # already warned about going over Sizes.element_budget_ms
+        self.analysis:SongAnalysis|None = None
+        self.memory:MemoryTracker|None = None
         self.tags:list[MetadataTag] = []
         self.resolution_textfield:TextField|None = None
         self.ready = False
-        self.draw_info("removing old images")
-        tmp_cleanup()
+        self.library:Library|None = None
+        self.browser:LibraryBrowser|None = None
+        self.song_queue:SongQueue|None = None
+        self.dropped_songs:list[Path] = [] # dropped this frame, several files dropped at once arrive as one event each
+        if not render_state:
+            self.draw_info("removing old images")
+            tmp_cleanup()
+            self.song_queue = SongQueue()
+            self.library = Library() # main.py starts the rescan, tools like the event replay dont need one
 
         if song_path:
             self.set_song(song_path)
 
+    @property
+    def soundwave(self) -> SoundWave|None:
+        return self.elements.get("soundwave")
+
+    @property
+    def scrubbar(self) -> ScrubBar|None:
+        return self.elements.get("scrubbar")
+
+    @property
+    def equalizer(self) -> Equalizer|None:
+        return self.elements.get("equalizer")
+
+    @property
+    def spectrogram(self) -> Spectrogram|None:
+        return self.elements.get("spectrogram")
+
     def draw_info(self, txt:str):
         """ prints text in the middle of the screen """
         if self.render_state:
@@ -45,66 +104,143 @@ class Orchester:
         self.window.blit(txt_surface, (x,y))
         pygame.display.flip()
 
-    def set_song(self, song_path:Path):
+    def set_song(self, song_path:Path, song:PreparedSong|None = None):
+        """ opens the song, song is its already prepared data if the queue prefetched it """
         if song_path.suffix not in AllowedFileTypes.audio:
             print(song_path, " is not a acceptable audio file")
             return
         
         self.song_path = song_path
+        self.memory = MemoryTracker(f"loading {song_path.name}")
+
+        # songs picked up by the watch folder were decoded and analysed ahead of time
+        self.loading_stage("Loading prepared song")
+        song = song or load_prepared(song_path) or prepare_song(song_path, self.loading_stage)
+        self.audio_path = song.audio_path
 
         if not self.render_state: # dont make a musicplayer if were rendering
-            self.draw_info("Setting up Musicplayer")
-            self.music_player = MusicPlayer(song_path, False)
-        
-        self.draw_info("Exctracting metadata")
-        self.metadata = get_metadata(song_path)
-        self.draw_info("Converting cover")
-        self.cover_raw = self.metadata["cover_art"]
-        self.cover_surface = convert_cover(self.metadata["cover_art"], self.window.size)
-        self.draw_info("Reading song")
-        self.song_data_full, self.sample_rate = sf.read(song_path)
-
-        self.draw_info("Converting song data")
-        amount_channels = 1
-        if len(self.song_data_full.shape) > 1:
-            amount_channels = self.song_data_full.shape[1]
-
-        if amount_channels > 1:
-            self.song_data_mono = np.mean(self.song_data_full, axis=1)
-        else:
-            self.song_data_mono = self.song_data_full
+            self.loading_stage("Setting up Musicplayer")
+            self.music_player = MusicPlayer(self.audio_path, False)
+
+        self.metadata = song.metadata
+        self.cover_raw = song.metadata["cover_art"]
+        self.set_cover_layers(song.cover_layers)
+        self.song_data_full = song.song_data_full
+        self.song_data_mono = song.song_data_mono
+        self.sample_rate = song.sample_rate
+        self.analysis = song.analysis
+        if not self.render_state:
+            self.scrubber = Scrubber(self.song_data_full, self.sample_rate)
 
         positions = get_element_positions(self.window.size)
-        self.draw_info("Setting up soundwave")
-        self.soundwave = SoundWave(positions["soundwave"], self.song_data_mono, self.sample_rate)
-        self.draw_info("Setting up scrubbar")
-        self.scrubbar = ScrubBar(positions["scrubbar"], self.song_data_mono, self.sample_rate)
-        self.draw_info("Setting up equalizer")
-        self.equalizer = Equalizer(positions["eqalizer"], self.song_data_mono, self.sample_rate)
-
-        self.draw_info("Setting up metadata tags")
+        self.elements = {}
+        self.element_times = {}
+        self.slow_elements = set()
+        for element_type in element_types:
+            self.loading_stage(f"Setting up {element_type.name}")
+            self.elements[element_type.name] = element_type(element_type.place(positions, self.window.size), song)
+        if not self.render_state:
+            with span("find highlights", "analysis"):
+                self.scrubbar.highlights = find_highlights(self.analysis, Sizes.highlight_length, Sizes.highlight_amount)
+
+        self.loading_stage("Setting up metadata tags")
         self.tags = []
         font_size = int(min(self.window.size) / 25)
 
         for y, (meta_type, value) in enumerate(self.metadata.items()):
             if meta_type == "cover_art": # dont put cover art as tag
                 continue
-            y_pos = self.soundwave.rect.bottom + y * (font_size + Sizes.meta_tag_padding)
+            y_pos = self.spectrogram.rect.bottom + y * (font_size + Sizes.meta_tag_padding)
             x_pos = Sizes.meta_tag_padding
             text = f"{meta_type}: {value}"
             tag = MetadataTag((x_pos, y_pos), text, not self.render_state, font_size)
             self.tags.append(tag)
 
         if not self.render_state:
-            self.draw_info("Setting up controls")
+            self.loading_stage("Setting up controls")
             self.start_fade_box = TextField(positions["start_fade_textfield"], time_to_str(0), True)
             self.end_fade_box = TextField(positions["end_fade_textfield"], time_to_str(self.scrubbar.end_pos), True)
             self.current_time_box = TextField(positions["current_time_textfield"], time_to_str(0), True)
             self.resolution_textfield = TextField(positions["resolution_textfield"], f"{Sizes.window_render[0]}x{Sizes.window_render[1]}", True)
             self.clipper_checkbox = CheckBox(positions["clipper_checkbox"], True)
 
+        self.memory.finish(self.memory_objects())
+        tracer.save()
         # self.music_player.resume()
         self.ready = True
+        if self.song_queue is not None:
+            self.song_queue.prefetch() # only now, so preparing the next songs doesnt slow down loading this one
+
+    def open_dropped(self):
+        """ the first of the songs dropped since the last frame gets opened, the others are queued behind it """
+        first, *rest = self.dropped_songs
+        self.dropped_songs = []
+        if rest:
+            self.song_queue.add(rest) # prefetched once the first one is loaded
+        self.try_set_song(first)
+
+    def next_song(self):
+        queued = self.song_queue.next()
+        if queued is None:
+            print("no songs queued, drop several songs at once to queue them")
+            return
+        self.try_set_song(*queued)
+
+    def try_set_song(self, *args):
+        """ set_song for songs opened from the app, a song going over the memory budget shows a message instead of closing the app """
+        try:
+            self.set_song(*args)
+        except MemoryBudgetExceeded as e:
+            self.ready = False # the last song is already partly replaced
+            pygame.mixer_music.stop()
+            self.show_notice(f"loading failed: {e}")
+
+    def loading_stage(self, txt:str):
+        """ shows what set_song is doing, memory is accounted per stage """
+        self.memory.begin(txt)
+        self.draw_info(txt)
+
+    def memory_objects(self) -> dict[str, object]:
+        """ everything holding big arrays, for the memory report """
+        return {
+            "song_data_full": self.song_data_full,
+            "song_data_mono": self.song_data_mono,
+            "analysis": self.analysis,
+            **self.elements,
+        }
+
+    def set_cover_layers(self, cover_layers:CoverLayers, cover_animation:CoverAnimation|None = None):
+        """ decoded and blurred cover, only scaling is left for every window size """
+        self.cover_layers = cover_layers
+        self.covers = {}
+        self.cover_surface = self.cover_view(self.window.size)
+        self.cover_animation = cover_animation
+        self.cover_frames = self.animation_view(self.window.size)
+
+    def animation_view(self, size:tuple[int,int]) -> CoverAnimation|None:
+        if self.cover_animation is None:
+            return None
+        with span("compose cover animation", "draw", frames=len(self.cover_animation.frames)):
+            return self.cover_animation.composed(size)
+
+    def cover_index(self, time_pos:float) -> int:
+        """ frame of the animated cover shown at time_pos, -1 for still covers """
+        return -1 if self.cover_frames is None else self.cover_frames.frame_index(time_pos)
+
+    def cover_at(self, time_pos:float) -> pygame.Surface:
+        index = self.cover_index(time_pos)
+        return self.cover_surface if index < 0 else self.cover_frames.frames[index]
+
+    def cover_view(self, size:tuple[int,int]) -> pygame.Surface:
+        return cached_view(self.covers, size, lambda: compose_cover(self.cover_layers, size))
+
+    def selection_changed(self):
+        """ start and end got set from outside the textfields, update those and the faded audio """
+        self.start_fade_box.text = time_to_str(self.scrubbar.start_pos)
+        self.start_fade_box.draw()
+        self.end_fade_box.text = time_to_str(self.scrubbar.end_pos)
+        self.end_fade_box.draw()
+        self.fade()
 
     def fade(self):
         fade_song(
@@ -115,80 +251,217 @@ class Orchester:
         )
         self.music_player = MusicPlayer(Paths.tmp_audio, self.music_player.playing, self.scrubbar.current_time)
 
+    def show_notice(self, txt:str):
+        """ prints the text and shows it over the preview for Sizes.notice_time seconds """
+        print(txt)
+        surface = Fonts.medium.render(txt, True, "white", Colors.background, self.window.width - 10)
+        self.notice = surface, time.perf_counter() + Sizes.notice_time
+
+    def notice_blit(self) -> tuple[pygame.Surface, tuple[float, float]]|None:
+        """ the notice centered on the window while its shown """
+        if self.notice is None:
+            return None
+        surface, until = self.notice
+        if time.perf_counter() >= until:
+            self.notice = None
+            return None
+        return surface, ((self.window.width - surface.width) / 2, (self.window.height - surface.height) / 2)
+
+    def try_render(self, *args, **kwargs):
+        """ render_targets for the keys, a failing ffmpeg or a target size that cant be reached shows a message instead of closing the app """
+        try:
+            self.render_targets(*args, **kwargs)
+        except subprocess.CalledProcessError as e: # ffmpeg already printed why
+            self.show_notice(f"render failed, {e.cmd[0]} exited with {e.returncode}, see the console")
+        except (RuntimeError, ValueError, MemoryBudgetExceeded) as e:
+            self.show_notice(f"render failed: {e}")
+
     def render(self):
-        print("starting render")
+        self.try_render([Sizes.window_render])
 
-        surface = pygame.Surface(Sizes.window_render, pygame.SRCALPHA)
-        orchester = Orchester(surface, render_state=True)
-        fade_surface = surface.copy() # used for fading from/to black and the start/end of clip
-        time_pos = self.scrubbar.start_pos
-        frame_num = 0
-        start = self.scrubbar.start_pos
-        end = self.scrubbar.end_pos
-        dur = end - start
-        fade_dur = Sizes.song_fade_time
-        total_frames = int(dur * Sizes.render_framerate)
-        out_path = (Paths.video_output / self.song_path.name).with_suffix(".mkv")
+    def render_draft(self):
+        """ quick render at preview size and draft fps to check timing and layout """
+        self.try_render([self.window.size], draft=True)
 
-        positions = get_element_positions(Sizes.window_render)
+    def render_orchester(self, resolution:tuple[int,int], cover_layers:CoverLayers) -> "Orchester":
+        """ sets up a orchester that draws the clip at the given resolution """
+        surface = pygame.Surface(resolution, pygame.SRCALPHA)
+        orchester = Orchester(surface, render_state=True)
+        positions = get_element_positions(resolution)
 
-        orchester.cover_surface = convert_cover(self.cover_raw, Sizes.window_render)
-        orchester.soundwave = self.soundwave.copy(positions["soundwave"])
-        orchester.scrubbar = self.scrubbar.copy(positions["scrubbar"])
-        orchester.equalizer = self.equalizer.copy(positions["eqalizer"])
+        orchester.cover_surface = compose_cover(cover_layers, resolution)
+        orchester.cover_frames = self.animation_view(resolution) # drafts get the blurred frames as well, its only scaling here
+        orchester.elements = {name: element.copy(type(element).place(positions, resolution)) for name, element in self.elements.items()}
 
         idx = 0
-        font_size = int(min(Sizes.window_render) / 25)
+        font_size = int(min(resolution) / 25)
         for tag in self.tags:
             if not tag.checkbox.checked: continue
-            y_pos = orchester.soundwave.rect.bottom + idx * (font_size + Sizes.meta_tag_padding)
+            y_pos = orchester.spectrogram.rect.bottom + idx * (font_size + Sizes.meta_tag_padding)
             x_pos = Sizes.meta_tag_padding
             tag = MetadataTag((x_pos,y_pos), tag.textbox.text, False, font_size)
             orchester.tags.append(tag)
             idx += 1
 
-        while time_pos < end:
-            print(f"rendering frame {frame_num}/{total_frames}", end="\r")
-            orchester.scrubbar.current_time = time_pos
-            orchester.draw()
-
-            if time_pos < start + fade_dur:
-                alpha = 255 - int((time_pos-start) / fade_dur * 255)
-                fade_surface.fill((0,0,0,alpha))
-                surface.blit(fade_surface, (0,0))
-
-            elif time_pos > end - fade_dur:
-                alpha = 255 - int((end-time_pos) / fade_dur * 255)
-                fade_surface.fill((0,0,0,alpha))
-                surface.blit(fade_surface, (0,0))
-
-            file_path = Paths.images / f"{frame_num:05d}.bmp"
-            pygame.image.save(surface, file_path)
-            time_pos += 1 / Sizes.render_framerate
-            frame_num += 1
-
-        print(f"\nstitching together")
-
-        cmd = [
-            "ffmpeg", "-y",
-            "-framerate", str(Sizes.render_framerate),
-            "-start_number", "0",
-            "-i", str(Paths.images)+r"/%05d.bmp",
-            "-ss", str(start),
-            "-t", str(dur),
-            "-i", str(self.song_path),
-            "-af", f"afade=t=in:st=0:d={fade_dur},afade=t=out:st={dur-fade_dur}:d={fade_dur}",
-            "-c:v", "libx264", "-pix_fmt", "yuv420p",
-            "-c:a", "aac", "-b:a", "128k",
-            "-r", str(Sizes.render_framerate),
-            str(out_path)
-        ]
+        return orchester
 
-        print(f"ffmpeg command:\n{' '.join(cmd)}")
+    def frame_key(self, static_key:str, time_pos:float, alpha:int) -> str:
+        """ cache key of the frame this (render) orchester draws at time_pos """
+        return hash_content(
+            static_key,
+            *(element.state_key(time_pos) for element in self.elements.values()),
+            self.cover_index(time_pos),
+            alpha,
+        )
 
-        subprocess.run(cmd)
+    def render_targets(self, resolutions:list[tuple[int,int]], draft:bool = False, extension:str = ".mkv", out_dir:Path|None = None,
+                       progress:Callable[[str, float], None]|None = None, clips:list[tuple[float,float]]|None = None,
+                       target_mb:float = 0) -> tuple[list[Path], dict[str, float]]:
+        """ renders every clip (default the selection) once per resolution, sharing the analysis, cover, element setup and audio between all of them
+        progress gets called with the current stage and how far along it is, returns the videos and the time per stage
+        with a target_mb every video gets encoded in two passes to fit that size """
+        clips = clips or [(self.scrubbar.start_pos, self.scrubbar.end_pos)]
+        resolutions = [even_size(resolution) for resolution in resolutions] # drafts use the window size, 405x900 by default
+        print(f"starting {'draft ' if draft else ''}render of {len(clips)} clip(s) in {len(resolutions)} resolution(s)")
+        report = progress or (lambda stage, fraction: None)
+        timings:dict[str, float] = {}
+        render_start = time.perf_counter()
+        report("setup", 0)
+        memory = MemoryTracker(f"rendering {self.song_path.name}")
+        memory.begin("audio and cover")
+        song_hash = hash_file(self.song_path)
+        # clip audio is named after everything it depends on, so rendering the same selection again reuses it
+        audio_paths = [
+            Paths.clip_audio.with_stem(f"{Paths.clip_audio.stem}_{hash_content(song_hash, start, end, Sizes.song_fade_time, Encoding.audio_bitrate)[:16]}")
+            for start, end in clips
+        ]
+        clear_render_dirs(tuple(audio_paths))
+        if out_dir:
+            out_dir.mkdir(parents=True, exist_ok=True)
 
-        print(f"done rendering! video is at {out_path.absolute()}")
+        fade_dur = Sizes.song_fade_time
+        fps = framerate(draft)
+        # ffmpeg does the work, threads just wait for it. audio is submitted first so the video encodes waiting for it cant block the pool
+        executor = ThreadPoolExecutor(len(clips) * len(resolutions))
+        audio_encodes = {} # the same clip queued twice shares one encode
+        for (start, end), path in zip(clips, audio_paths):
+            if path not in audio_encodes:
+                audio_encodes[path] = executor.submit(lambda start, end, path: encode_audio(fade_clip(self.song_data_full, self.sample_rate, start, end), self.sample_rate, path), start, end, path)
+        audio_jobs = [audio_encodes[path] for path in audio_paths]
+        with span("decode and blur cover", "render"):
+            # decode and blur once, only scaling is per target. the preview already has the blurred one, drafts skip the blur
+            cover_layers = load_cover(self.cover_raw, False) if draft else self.cover_layers
+        frame_cache = FrameCache() if Sizes.frame_cache else None
+        cover_hash = hash_cover(self.cover_raw)
+        style_hash = hash_style()
+
+        memory.begin("render orchesters")
+        targets:list[RenderTarget] = []
+        for resolution in resolutions:
+            name = f"{resolution[0]}x{resolution[1]}"
+            base = self.render_orchester(resolution, cover_layers) # cover and element backgrounds are composited once per resolution
+            fade_surface = base.window.copy() # used for fading from/to black and the start/end of clip
+            tags = [t.textbox.text for t in base.tags]
+            static_key = hash_content(song_hash, cover_hash, style_hash, resolution, tags, draft)
+
+            for i, (start, end) in enumerate(clips):
+                suffix = f"_clip{i+1}" if len(clips) > 1 else ""
+                suffix += f"_{name}" if len(resolutions) > 1 else ""
+                suffix += "_draft" if draft else ""
+                suffix += f"_{target_mb:g}MB" if target_mb else ""
+                orchester = copy.copy(base) # only per clip elements like the scrubbar (start/end) get their own copy, everything else is shared
+                orchester.elements = {name: element.copy(element.rect) if element.per_clip else element for name, element in base.elements.items()}
+                orchester.scrubbar.start_pos = start
+                orchester.scrubbar.end_pos = end
+                images_dir = Paths.images / (f"{i}_{name}" if len(clips) > 1 else name)
+                images_dir.mkdir(parents=True, exist_ok=True)
+                out_path = (out_dir or Paths.video_output) / f"{self.song_path.stem}{suffix}{extension}"
+                targets.append(RenderTarget(orchester, fade_surface, images_dir, out_path, static_key, i, start, end, int((end - start) * fps)))
+
+        if target_mb: # a size the clips cant fit in fails here instead of after drawing every frame
+            try:
+                for target in targets:
+                    size_bitrate(int(target_mb * 1024**2), audio_jobs[target.clip].result().stat().st_size, target.total_frames / fps)
+            except ValueError:
+                executor.shutdown()
+                raise
+
+        def encode(target:RenderTarget):
+            encode_video(target.total_frames, audio_jobs[target.clip].result(), target.out_path, target.images_dir, draft, target_mb)
+
+        timings["setup"] = time.perf_counter() - render_start
+        memory.begin("drawing")
+        draw_start = time.perf_counter()
+        max_frames = max(target.total_frames for target in targets)
+        encodes = []
+        for frame_num in range(max_frames):
+            print(f"rendering frame {frame_num}/{max_frames}", end="\r")
+            report("drawing", frame_num / max(max_frames, 1))
+
+            # every target draws the same frame number before moving on, so the ones sharing a clip share the per frame state
+            for target in targets:
+                if frame_num >= target.total_frames:
+                    continue
+                time_pos = target.start + frame_num / fps
+                if time_pos < target.start + fade_dur:
+                    alpha = 255 - int((time_pos-target.start) / fade_dur * 255)
+                elif time_pos > target.end - fade_dur:
+                    alpha = 255 - int((target.end-time_pos) / fade_dur * 255)
+                else:
+                    alpha = 0
+
+                with span("frame", "render", frame=frame_num, target=target.images_dir.name):
+                    orchester = target.orchester
+                    orchester.scrubbar.current_time = time_pos
+                    file_path = target.images_dir / f"{frame_num:05d}.bmp"
+                    if frame_cache is not None:
+                        key = orchester.frame_key(target.static_key, time_pos, alpha)
+                        if frame_cache.fetch(key, file_path): # drawn exactly like this before
+                            continue
+
+                    orchester.draw()
+
+                    if alpha:
+                        target.fade_surface.fill((0,0,0,alpha))
+                        orchester.window.blit(target.fade_surface, (0,0))
+
+                    if frame_cache is None:
+                        with span("save frame", "io"):
+                            pygame.image.save(orchester.window, file_path)
+                    else:
+                        frame_cache.store(orchester.window, key, file_path)
+
+            # shorter clips are encoded while the longer ones are still drawing
+            encodes += [executor.submit(encode, target) for target in targets if target.total_frames == frame_num + 1]
+
+        timings["drawing"] = time.perf_counter() - draw_start
+        print()
+        if frame_cache is not None:
+            print(frame_cache.stats())
+        print(f"stitching together")
+        report("encoding", 0)
+
+        memory.begin("encoding")
+        encode_start = time.perf_counter()
+        try:
+            for job in encodes:
+                job.result()
+        finally:
+            executor.shutdown()
+        timings["encoding"] = time.perf_counter() - encode_start # only the part that didnt overlap with drawing
+        memory.finish({
+            f"{target.images_dir.name}.{name}": element
+            for target in targets for name, element in target.orchester.elements.items()
+        })
+        tracer.save()
+        report("done", 1)
+
+        preset = Draft.preset if draft else Encoding.preset
+        print(f"drawing frames took {timings['drawing']:.1f}s, encoding took {timings['encoding']:.1f}s more ({Encoding.segments} segments, preset {preset})")
+        outputs = [target.out_path for target in targets]
+        for out_path in outputs:
+            print(f"done rendering! video is at {out_path.absolute()}")
+        return outputs, timings
 
     def handle_event(self, event:pygame.Event):
         # quit wgen pressing X
@@ -196,19 +469,37 @@ class Orchester:
             pygame.quit()
             sys.exit(0)
 
-        # quick when pressing ESC
+        # quick when pressing ESC, or close the library browser
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_ESCAPE:
+                if self.browser is not None:
+                    self.browser = None
+                    return
                 pygame.quit()
                 sys.exit(0)
 
+            elif event.key == pygame.K_l and self.browser is None and not self.typing():
+                self.open_browser()
+                return
+
         elif event.type == pygame.DROPFILE:
             path = Path(event.file)
-            if path.suffix in AllowedFileTypes.audio:
-                self.set_song(Path(event.file))
+            if path.is_dir():
+                self.library.add_folder(path)
+                self.open_browser()
+            elif path.suffix in AllowedFileTypes.audio:
+                self.dropped_songs.append(path)
             elif path.suffix in AllowedFileTypes.image:
                 self.cover_raw = path
-                self.cover_surface = convert_cover(path, self.window.size)
+                self.set_cover_layers(load_cover(path), load_cover_animation(path))
+
+        # library browser takes all input while its open
+        if self.browser is not None:
+            picked = self.browser.handle_event(event)
+            if picked is not None:
+                self.browser = None
+                self.try_set_song(picked)
+            return
 
         if not self.ready:
             return
@@ -225,7 +516,43 @@ class Orchester:
                 self.music_player.toggle_pause()
 
             elif event.key == pygame.K_r and not typing:
-                self.render()
+                if event.mod & pygame.KMOD_SHIFT:
+                    self.try_render(Sizes.render_targets)
+                else:
+                    self.render()
+
+            elif event.key == pygame.K_d and not typing:
+                self.render_draft()
+
+            elif event.key == pygame.K_s and not typing:
+                stereo = not self.equalizer.stereo
+                self.soundwave.stereo = stereo
+                self.equalizer.set_stereo(stereo)
+                if self.analysis.channel_eq_frames is None:
+                    print("mono song, stereo view looks the same")
+
+            elif event.key == pygame.K_m and not typing:
+                self.try_render([Sizes.window_render], target_mb=Encoding.target_mb)
+
+            elif event.key == pygame.K_c and not typing:
+                if event.mod & pygame.KMOD_SHIFT:
+                    self.scrubbar.clips = []
+                else:
+                    self.scrubbar.add_clip()
+
+            elif event.key == pygame.K_b and not typing:
+                self.try_render([Sizes.window_render], clips=self.scrubbar.clips)
+
+            elif event.key == pygame.K_h and not typing and self.scrubbar.highlights:
+                current = self.scrubbar.selected_highlight
+                self.scrubbar.select_highlight(0 if current is None else current + 1)
+                self.selection_changed()
+
+            elif event.key == pygame.K_n and not typing:
+                if event.mod & pygame.KMOD_SHIFT:
+                    self.song_queue.clear()
+                else:
+                    self.next_song()
 
         # change scrub_bar when current_time_box changes
         if "text_changed" in self.current_time_box.handle_event(event):
@@ -260,11 +587,16 @@ class Orchester:
             for special_event in special_events:
                 # change current_time_box when scrub_bar changes
                 if special_event == "playing_pos changed":
-                    self.music_player.play_from_position(self.scrubbar.current_time)
+                    if not self.scrubber.active:
+                        self.scrubber.begin(self.music_player)
+                    self.scrubber.scrub(self.scrubbar.current_time)
                     self.current_time_box.text = time_to_str(self.scrubbar.current_time)
                     self.current_time_box.draw()
                     #print(self.current_time_box.text)
 
+                elif special_event == "highlight selected":
+                    self.selection_changed()
+
                 elif event.type == pygame.MOUSEBUTTONUP:
                     if event.button == 3:
                         # change start_fade_box when scrub_bar.start_pos changed
@@ -279,6 +611,10 @@ class Orchester:
                             self.end_fade_box.draw()
                             self.fade()
 
+        # back to streaming once the scrubbar is let go
+        if self.scrubber.active and not self.scrubbar.pressed_left:
+            self.scrubber.end(self.music_player, self.scrubbar.current_time)
+
         if "textfield_return" in self.resolution_textfield.handle_event(event):
             try:
                 wanted_x, wanted_y = list(map(int, self.resolution_textfield.text.split("x")))
@@ -294,14 +630,65 @@ class Orchester:
             except Exception as e:
                 print("cant read window size: ", e)
  
+    def typing(self) -> bool:
+        """ checks if any textfield is active, so key presses belong to it """
+        fields = [t.textbox for t in self.tags]
+        if self.ready and not self.render_state:
+            fields += [self.current_time_box, self.start_fade_box, self.end_fade_box, self.resolution_textfield]
+        return any(f.active for f in fields)
+
+    def input_targets(self) -> dict[str, pygame.Rect]:
+        """ everything that reacts to the mouse by name, topmost first, recorded sessions click these instead of pixels """
+        if self.browser is not None:
+            return {"library browser": self.browser.rect}
+        if not self.ready or self.render_state:
+            return {}
+        targets = {}
+        tag_names = [meta_type for meta_type in self.metadata if meta_type != "cover_art"] # same order as the tags
+        for meta_type, tag in zip(tag_names, self.tags):
+            targets[f"{meta_type} tag"] = tag.textbox.rect
+            targets[f"{meta_type} checkbox"] = tag.checkbox.rect
+        targets["clipper checkbox"] = self.clipper_checkbox.rect
+        targets["current time"] = self.current_time_box.rect
+        targets["start fade"] = self.start_fade_box.rect
+        targets["end fade"] = self.end_fade_box.rect
+        targets["resolution"] = self.resolution_textfield.rect
+        targets["scrubbar"] = self.scrubbar.rect
+        return targets
+
+    def target_at(self, pos:tuple[int,int]) -> tuple[str, pygame.Rect]|None:
+        for name, rect in self.input_targets().items():
+            if rect.collidepoint(pos):
+                return name, rect
+        return None
+
+    def open_browser(self):
+        margin = Sizes.meta_tag_padding
+        rect = pygame.Rect(margin, margin, self.window.width - 2*margin, self.window.height - 2*margin)
+        self.browser = LibraryBrowser(rect, self.library)
+
     def draw(self):
+        if self.dropped_songs:
+            self.open_dropped()
+
+        if self.pending_size is not None and time.perf_counter() - self.resize_requested >= Sizes.resize_debounce:
+            self.apply_resize()
+
         if not self.ready and not self.render_state:
-            self.draw_info("Drop in audiofile")
+            self.draw_info("Drop in audiofile or folder, L opens the library")
+            if self.browser is not None:
+                self.window.blit(*self.browser.draw())
+            notice = self.notice_blit()
+            if notice is not None:
+                self.window.blit(*notice)
             return
 
         # timepos is determined by scrubbar if rendering otherwise by musicplaywer
         if self.render_state:
             time_pos = self.scrubbar.current_time
+        elif self.scrubber.active: # music is paused while scrubbing, the grains follow the scrubbar
+            self.scrubber.update()
+            time_pos = self.scrubbar.current_time
         else:
             time_pos = self.music_player.get_current_position()
             self.scrubbar.current_time = time_pos
@@ -310,12 +697,8 @@ class Orchester:
                 self.current_time_box.text = time_to_str(time_pos)
                 self.current_time_box.draw()
 
-        blits_info = [
-            (self.cover_surface, (0,0)),
-            self.soundwave.draw(time_pos),
-            self.scrubbar.draw(),
-            self.equalizer.draw(time_pos),
-        ]
+        blits_info = [(self.cover_at(time_pos), (0,0))]
+        blits_info.extend(self.draw_elements(time_pos))
 
         if not self.render_state:
             blits_info.extend([
@@ -328,31 +711,55 @@ class Orchester:
 
         blits_info.extend([(t.surface, t.pos) for t in self.tags])
 
-        self.window.blits(blits_info)
+        if self.browser is not None:
+            blits_info.append(self.browser.draw())
 
-    def resize(self, size:tuple[int, int]):
-        pygame.display.set_mode(size, pygame.SRCALPHA)
-        positions = get_element_positions(size)
-        
-        if not self.ready:
-            self.cover_surface = convert_cover(None, size)
-            return
-        
-        self.cover_surface = convert_cover(self.metadata["cover_art"], size)
+        notice = self.notice_blit()
+        if notice is not None:
+            blits_info.append(notice)
 
-        self.soundwave.resize(positions["soundwave"])
-        self.scrubbar.resize(positions["scrubbar"])
-        self.equalizer.resize(positions["eqalizer"])
-        
-        # self.scrubbar.rect = positions["scrubbar"]
-        # self.scrubbar.calc_amplitudes()
-        # self.scrubbar.render_background()
+        with span("blit", "draw"):
+            self.window.blits(blits_info)
 
-        # self.soundwave.rect = positions["soundwave"]
-        # self.soundwave.render_background()
+    def draw_elements(self, time_pos:float) -> list:
+        """ blits of every element, the preview keeps a smoothed draw time per element and says once when one gets over Sizes.element_budget_ms """
+        blits = []
+        for name, element in self.elements.items():
+            start = time.perf_counter()
+            with span(name, "draw"):
+                blits.extend(element.draw(time_pos))
+            if self.render_state:
+                continue
+            took = (time.perf_counter() - start) * 1000
+            took = self.element_times[name] = self.element_times.get(name, took) * 0.9 + took * 0.1
+            if took > Sizes.element_budget_ms and name not in self.slow_elements:
+                self.slow_elements.add(name)
+                print(f"{name} takes {took:.1f}ms per frame, over Sizes.element_budget_ms ({Sizes.element_budget_ms}ms)")
+        return blits
 
-        # self.equalizer.rect = positions["eqalizer"]
-        # self.equalizer.render_background()
+    def resize(self, size:tuple[int, int]):
+        """ asks for a new window size, draw applies it once no other size was asked for in Sizes.resize_debounce seconds """
+        self.pending_size = size
+        self.resize_requested = time.perf_counter()
+
+    def apply_resize(self):
+        """ switches the window and every element to the pending size, the per size views of the elements are cached
+        so going back to a size used before only swaps references """
+        size, self.pending_size = self.pending_size, None
+        if size == self.window.size:
+            return
+        with span("resize", "draw", size=list(size)):
+            self.window = pygame.display.set_mode(size, pygame.SRCALPHA)
+            self.browser = None
+            self.cover_surface = self.cover_view(size)
+            self.cover_frames = self.animation_view(size)
+            if self.ready:
+                self.resize_elements(size)
+
+    def resize_elements(self, size:tuple[int, int]):
+        positions = get_element_positions(size)
+        for element in self.elements.values():
+            element.resize(type(element).place(positions, size))
 
         self.current_time_box.pos = positions["current_time_textfield"]
         self.start_fade_box.pos = positions["start_fade_textfield"]
@@ -0,0 +1,95 @@
+""" decoded songs as float32 wav files in Paths.pcm_cache, so compressed songs get decoded once instead of on every open
+
+the same file is memory mapped for analysis and scrubbing, streamed by the mixer for playback and read by ffmpeg for the render audio
+"""
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+from .const import Paths, Sizes
+from .frame_cache import hash_file
+from .tracing import span
+
+UNCOMPRESSED = {".wav"} # read directly, decoding them is as cheap as loading the cache
+
+def pcm_path(song_path:Path) -> Path:
+    return Paths.pcm_cache / f"{hash_file(song_path)}.wav"
+
+def cached_pcm(song_path:Path) -> Path|None:
+    """ the decoded wav of the song if there is one, the song itself if it doesnt need decoding """
+    if song_path.suffix.lower() in UNCOMPRESSED:
+        return song_path
+    path = pcm_path(song_path)
+    return path if path.exists() else None
+
+def data_offset(path:Path) -> tuple[int, int]:
+    """ byte offset and size of the samples in a wav file, the chunks in front of them vary between writers """
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"{path} is not a wav file")
+        while header := f.read(8):
+            chunk, size = struct.unpack("<4sI", header)
+            if chunk == b"data":
+                return f.tell(), size
+            f.seek(size + size % 2, os.SEEK_CUR) # chunks are padded to even sizes
+    raise ValueError(f"{path} has no data chunk")
+
+def open_pcm(path:Path) -> tuple[np.ndarray, int]:
+    """ samples of a float32 wav as read only memory map of shape (frames, channels), nothing is read until its used """
+    info = sf.info(path)
+    offset, size = data_offset(path)
+    frames = min(info.frames, size // (4 * info.channels))
+    return np.memmap(path, np.float32, "r", offset, (frames, info.channels)), info.samplerate
+
+def decode(song_path:Path) -> Path:
+    """ decodes the song block by block into the cache, so the whole song never has to be in memory as float64 """
+    path = pcm_path(song_path)
+    partial = path.with_name(f"{path.stem}.{os.getpid()}.tmp.wav") # other processes might decode the same song meanwhile
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with span("decode to pcm cache", "io", song=song_path.name):
+        with sf.SoundFile(song_path) as source, sf.SoundFile(partial, "w", source.samplerate, source.channels, "FLOAT", format="WAV") as target:
+            for block in source.blocks(Sizes.pcm_block_frames, dtype="float32"):
+                target.write(block)
+        os.replace(partial, path)
+    evict(keep=path)
+    return path
+
+def load_pcm(song_path:Path) -> tuple[Path, np.ndarray, int]:
+    """ path to play and encode from, samples as (frames, channels) or (frames,) for mono, and the sample rate
+    compressed songs are decoded into the cache on first use and memory mapped from there on """
+    path = cached_pcm(song_path)
+    if path == song_path:
+        song_data, sample_rate = sf.read(song_path)
+        return song_path, song_data, sample_rate
+    if path is None:
+        path = decode(song_path)
+    else:
+        os.utime(path) # mark as recently used for eviction
+    song_data, sample_rate = open_pcm(path)
+    if song_data.shape[1] == 1:
+        song_data = song_data[:, 0] # like sf.read does for mono files
+    return path, song_data, sample_rate
+
+def evict(keep:Path|None = None):
+    """ removes least recently used songs until the cache fits in Sizes.pcm_cache_max_mb, open memory maps keep working on linux """
+    files = []
+    for f in Paths.pcm_cache.glob("*.wav"):
+        try:
+            files.append((f.stat(), f))
+        except FileNotFoundError: # evicted by another process meanwhile
+            pass
+    total = sum(stat.st_size for stat, _ in files)
+    for stat, f in sorted(files, key=lambda x: x[0].st_mtime):
+        if total <= Sizes.pcm_cache_max_mb * 1024**2:
+            break
+        if f == keep or ".tmp" in f.suffixes:
+            continue
+        try:
+            f.unlink(True)
+        except PermissionError: # still mapped or played on windows
+            continue
+        total -= stat.st_size
@@ -0,0 +1,264 @@
+""" local render service, queues render jobs over http and runs them on a pool of worker processes
+
+start it with `python -m scripts.render_service`, then for example
+    curl -X POST localhost:8765/jobs -d '{"song": "/music/song.flac", "start": 30, "end": 45, "tags": ["title", "artist"]}'
+    curl localhost:8765/jobs/<id>
+    curl localhost:8765/metrics
+"""
+import os
+import json
+import time
+import signal
+import uuid
+import argparse
+import threading
+import traceback
+import multiprocessing
+from pathlib import Path
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .const import Paths, Sizes, Service, AllowedFileTypes
+
+FORMATS = {"mkv": ".mkv", "mp4": ".mp4"} # container the job asks for -> file extension
+
+def parse_job(data:dict) -> dict:
+    """ validates a job from the api and fills in defaults, raises ValueError with a readable message """
+    if not isinstance(data, dict) or "song" not in data:
+        raise ValueError("job needs at least a song path")
+    song = Path(data["song"])
+    if not song.is_file() or song.suffix not in AllowedFileTypes.audio:
+        raise ValueError(f"{song} is not a acceptable audio file")
+
+    resolutions = data.get("resolutions") or [data.get("resolution", Sizes.window_render)]
+    try:
+        resolutions = [(int(w), int(h)) for w, h in resolutions]
+        start = float(data.get("start", 0))
+        end = float(data["end"]) if data.get("end") is not None else None
+        clips = [(float(s), float(e)) for s, e in data.get("clips", [])]
+        target_mb = float(data.get("target_mb") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("start/end must be seconds, clips pairs of seconds, resolutions pairs of ints and target_mb a number")
+    if any(w <= 0 or h <= 0 for w, h in resolutions):
+        raise ValueError("resolutions must be positive")
+    if target_mb < 0:
+        raise ValueError("target_mb must be positive")
+
+    container = data.get("format", "mkv")
+    if container not in FORMATS:
+        raise ValueError(f"format must be one of {list(FORMATS)}")
+
+    return {
+        "song": str(song.absolute()),
+        "start": start,
+        "end": end, # None means till the end of the song
+        "clips": clips, # several start/end pairs rendered in one go, replaces start/end if given
+        "resolutions": resolutions,
+        "tags": [str(t) for t in data.get("tags", [])],
+        "format": container,
+        "draft": bool(data.get("draft", False)),
+        "target_mb": target_mb, # 0 encodes with constant quality
+    }
+
+def worker_main(worker_id:int, jobs:multiprocessing.Queue, events:multiprocessing.Queue):
+    """ runs in its own process, keeps pygame, fonts and the last few analysed songs around between jobs """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl+c goes to the whole group, the service shuts workers down itself
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import pygame
+    pygame.init()
+    from .orchester import Orchester
+    from .frame_cache import hash_file
+    from .encoder import framerate
+
+    # every worker gets its own scratch folders, the frame cache is shared since its content addressed
+    scratch = Paths.images.parent / "workers" / str(worker_id)
+    Paths.images = scratch / "images"
+    Paths.segments = scratch / "segments"
+    Paths.clip_audio = scratch / "audio" / "clip_audio.m4a"
+    songs:OrderedDict[str, Orchester] = OrderedDict()
+
+    while (job := jobs.get()) is not None:
+        job_id, spec = job
+        events.put(("running", job_id, {"worker": os.getpid()}))
+        last_report = ("", -1.)
+
+        def progress(stage:str, fraction:float):
+            nonlocal last_report
+            if stage != last_report[0] or fraction - last_report[1] >= 0.01: # dont flood the queue with every frame
+                last_report = stage, fraction
+                events.put(("progress", job_id, {"stage": stage, "progress": fraction}))
+
+        try:
+            load_start = time.perf_counter()
+            song_path = Path(spec["song"])
+            key = hash_file(song_path)
+            if key in songs:
+                songs.move_to_end(key)
+            else:
+                progress("loading", 0)
+                orchester = Orchester(pygame.Surface(Sizes.window, pygame.SRCALPHA), render_state=True)
+                orchester.set_song(song_path)
+                songs[key] = orchester
+                while len(songs) > Service.warm_songs:
+                    songs.popitem(last=False)
+            orchester = songs[key]
+            load_time = time.perf_counter() - load_start
+
+            song_length = orchester.scrubbar.song_length
+            clips = spec["clips"] or [(spec["start"], spec["end"] if spec["end"] is not None else song_length)]
+            for start, end in clips:
+                if not 0 <= start < end - 2*Sizes.song_fade_time or end > song_length:
+                    raise ValueError(f"start/end {start}-{end} dont fit in the song ({song_length:.1f}s) with fades")
+            for tag in orchester.tags:
+                tag.checkbox.checked = tag.textbox.text.split(":")[0] in spec["tags"]
+
+            outputs, timings = orchester.render_targets(
+                spec["resolutions"],
+                spec["draft"],
+                FORMATS[spec["format"]],
+                Paths.video_output / "service" / job_id,
+                progress,
+                clips,
+                spec["target_mb"],
+            )
+            frames = sum(int((end - start) * framerate(spec["draft"])) for start, end in clips) * len(spec["resolutions"])
+            events.put(("done", job_id, {
+                "outputs": [str(p.absolute()) for p in outputs],
+                "timings": {"loading": load_time, **timings},
+                "frames": frames,
+            }))
+        except Exception as e:
+            events.put(("failed", job_id, {"error": str(e), "traceback": traceback.format_exc()}))
+
+
+class RenderService:
+    def __init__(self, workers:int = Service.workers) -> None:
+        context = multiprocessing.get_context("spawn") # same behaviour on every os, and no forked sdl state
+        self.queue = context.Queue()
+        self.events = context.Queue()
+        self.jobs:dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.workers = [context.Process(target=worker_main, args=(i, self.queue, self.events), daemon=True) for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+        threading.Thread(target=self.collect, daemon=True).start()
+
+    def submit(self, data:dict) -> str:
+        spec = parse_job(data)
+        job_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            self.jobs[job_id] = {"id": job_id, "state": "queued", "spec": spec, "submitted": time.time(), "stage": None, "progress": 0.}
+        self.queue.put((job_id, spec))
+        return job_id
+
+    def collect(self):
+        """ applies status updates from the workers to the job table """
+        while True:
+            state, job_id, info = self.events.get()
+            with self.lock:
+                job = self.jobs[job_id]
+                job.update(info)
+                if state == "running":
+                    job["started"] = time.time()
+                if state in ("done", "failed"):
+                    job["finished"] = time.time()
+                if state != "progress":
+                    job["state"] = state
+
+    def status(self, job_id:str) -> dict|None:
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list_jobs(self) -> list[dict]:
+        with self.lock:
+            return [{k: job.get(k) for k in ("id", "state", "stage", "progress")} for job in self.jobs.values()]
+
+    def metrics(self) -> dict:
+        with self.lock:
+            jobs = list(self.jobs.values())
+        uptime = time.time() - self.started
+        done = [job for job in jobs if job["state"] == "done"]
+        states = {state: sum(job["state"] == state for job in jobs) for state in ("queued", "running", "done", "failed")}
+        stages:dict[str, float] = {}
+        for job in done:
+            for stage, seconds in job["timings"].items():
+                stages[stage] = stages.get(stage, 0.) + seconds
+        busy = sum(job["finished"] - job["started"] for job in done)
+        frames = sum(job["frames"] for job in done)
+        return {
+            "uptime": uptime,
+            "workers": len(self.workers),
+            "jobs": states,
+            "jobs_per_minute": len(done) / uptime * 60 if uptime else 0,
+            "frames_per_second": frames / busy if busy else 0,
+            "average_timings": {stage: total / len(done) for stage, total in stages.items()},
+            "average_queue_time": sum(job["started"] - job["submitted"] for job in done) / len(done) if done else 0,
+        }
+
+    def shutdown(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join(5)
+
+
+def make_handler(service:RenderService) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status:int, data):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["jobs"]:
+                self.send_json(200, service.list_jobs())
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = service.status(parts[1])
+                self.send_json(200, job) if job else self.send_json(404, {"error": "no such job"})
+            elif parts == ["metrics"]:
+                self.send_json(200, service.metrics())
+            else:
+                self.send_json(404, {"error": "unknown path"})
+
+        def do_POST(self):
+            if self.path.strip("/") != "jobs":
+                self.send_json(404, {"error": "unknown path"})
+                return
+            try:
+                data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                self.send_json(201, {"id": service.submit(data)})
+            except (ValueError, KeyError) as e:
+                self.send_json(400, {"error": str(e)})
+
+        def log_message(self, format, *args): # keep the console for render output
+            pass
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="local render service for music-share")
+    parser.add_argument("--host", default=Service.host)
+    parser.add_argument("--port", type=int, default=Service.port)
+    parser.add_argument("--workers", type=int, default=Service.workers)
+    args = parser.parse_args()
+
+    service = RenderService(args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"render service with {args.workers} workers on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import os
+import json
+import shutil
+from pathlib import Path
+from typing import Callable
+from dataclasses import dataclass
+
+import numpy as np
+import pygame
+
+from .const import Paths, Sizes
+from .helpers import get_metadata, load_cover, CoverLayers
+from .analysis import SongAnalysis, analyse_song, save_analysis, load_analysis
+from .frame_cache import hash_content, hash_file
+from .pcm_cache import load_pcm
+from .tracing import tracer
+
+# settings the stored analysis and cover depend on, changing any of them makes every song get prepared again
+ANALYSIS_SETTINGS = (
+    "fft_window_size", "fft_hop_size", "fft_low_freq", "fft_high_freq", "amount_bars", "clipping_threshold",
+    "analysis_block_hops", "true_peak_oversampling", "true_peak_taps", "blur_radius",
+)
+ANALYSIS_VERSION = 2 # bump when analyse_song stores something new, every song gets prepared again
+
+@dataclass
+class PreparedSong:
+    """ everything set_song needs from the audio file, either computed now or loaded from Paths.song_cache """
+    song_data_full: np.ndarray
+    song_data_mono: np.ndarray
+    sample_rate: int
+    analysis: SongAnalysis
+    metadata: dict          # like get_metadata, including cover_art
+    cover_layers: CoverLayers
+    audio_path: Path        # what playback and the render audio read, the decoded wav from the pcm cache if there is one
+
+def song_key(song_path:Path) -> str:
+    return hash_content(hash_file(song_path), ANALYSIS_VERSION, [(name, getattr(Sizes, name)) for name in ANALYSIS_SETTINGS])
+
+def song_folder(song_path:Path) -> Path:
+    return Paths.song_cache / song_key(song_path)
+
+def is_prepared(song_path:Path) -> bool:
+    return song_folder(song_path).is_dir()
+
+def prepare_song(song_path:Path, info:Callable[[str], None] = lambda txt: None) -> PreparedSong:
+    """ decodes, downmixes and analyses the song, info gets called with the current step for the loading screen """
+    info("Exctracting metadata")
+    metadata = get_metadata(song_path)
+    info("Converting cover")
+    cover_layers = load_cover(metadata["cover_art"])
+    info("Reading song")
+    audio_path, song_data_full, sample_rate = load_pcm(song_path)
+
+    info("Converting song data")
+    if song_data_full.ndim > 1 and song_data_full.shape[1] > 1:
+        song_data_mono = np.mean(song_data_full, axis=1)
+    else:
+        song_data_mono = song_data_full
+
+    info("Analysing song")
+    analysis = analyse_song(song_data_mono, sample_rate, song_data_full)
+    if tracer.enabled: # the blocks are spans in the trace as well, this is the summary
+        print(analysis.report())
+    return PreparedSong(song_data_full, song_data_mono, sample_rate, analysis, metadata, cover_layers, audio_path)
+
+def store_prepared(song_path:Path, song:PreparedSong) -> Path:
+    """ writes the prepared song next to the others, into a temporary folder first so readers never see half of it
+    the samples themselves stay in the pcm cache (or the wav itself), only the downmix is stored here """
+    folder = song_folder(song_path)
+    partial = folder.with_name(f"{folder.name}.{os.getpid()}.tmp")
+    partial.mkdir(parents=True, exist_ok=True)
+
+    # float32 halves the size and is plenty for drawing
+    if song.song_data_mono is not song.song_data_full:
+        np.save(partial / "mono.npy", song.song_data_mono.astype(np.float32))
+    save_analysis(song.analysis, partial / "analysis.npz")
+
+    metadata = dict(song.metadata)
+    cover = metadata.pop("cover_art")
+    (partial / "metadata.json").write_text(json.dumps(metadata))
+    if cover:
+        (partial / "cover.bin").write_bytes(cover)
+    if song.cover_layers:
+        pygame.image.save(song.cover_layers[0], partial / "cover.png")
+        pygame.image.save(song.cover_layers[1], partial / "cover_blur.png")
+
+    try:
+        os.replace(partial, folder)
+    except OSError: # prepared by someone else meanwhile
+        shutil.rmtree(partial, ignore_errors=True)
+    evict(keep=folder)
+    return folder
+
+def load_prepared(song_path:Path) -> PreparedSong|None:
+    """ the stored song if the file was prepared with the current settings, the arrays are memory mapped
+    the samples come from the pcm cache, decoding again if it evicted them meanwhile still skips the analysis """
+    folder = song_folder(song_path)
+    if not folder.is_dir():
+        return None
+    try:
+        metadata = json.loads((folder / "metadata.json").read_text())
+        metadata.pop("sample_rate_data", None) # written by older versions
+        metadata["cover_art"] = (folder / "cover.bin").read_bytes() if (folder / "cover.bin").exists() else None
+
+        audio_path, song_data_full, sample_rate = load_pcm(song_path)
+        mono_path = folder / "mono.npy"
+        song_data_mono = np.load(mono_path, mmap_mode="r") if mono_path.exists() else song_data_full
+
+        cover_layers = None
+        if (folder / "cover.png").exists():
+            cover_layers = pygame.image.load(folder / "cover.png"), pygame.image.load(folder / "cover_blur.png")
+
+        analysis = load_analysis(folder / "analysis.npz")
+    except (OSError, ValueError, KeyError) as e:
+        print("ignoring broken prepared song", folder, e)
+        return None
+
+    os.utime(folder) # mark as recently used for eviction
+    return PreparedSong(song_data_full, song_data_mono, sample_rate, analysis, metadata, cover_layers, audio_path)
+
+def folder_size(folder:Path) -> int:
+    size = 0
+    for f in folder.iterdir():
+        try:
+            size += f.stat().st_size
+        except FileNotFoundError:
+            pass
+    return size
+
+def evict(keep:Path|None = None):
+    """ removes least recently used songs until the cache fits in Sizes.song_cache_max_mb
+    a folder is renamed before its removed, so readers see the whole song or none, open memory maps keep working on linux """
+    folders = []
+    for folder in Paths.song_cache.iterdir():
+        if ".tmp" in folder.name or not folder.is_dir():
+            continue
+        try:
+            folders.append((folder.stat().st_mtime, folder_size(folder), folder))
+        except FileNotFoundError: # evicted by another process meanwhile
+            pass
+    total = sum(size for _, size, _ in folders)
+    for _, size, folder in sorted(folders, key=lambda x: x[0]):
+        if total <= Sizes.song_cache_max_mb * 1024**2:
+            break
+        if folder == keep:
+            continue
+        removed = folder.with_name(f"{folder.name}.{os.getpid()}.evicted.tmp")
+        try:
+            os.replace(folder, removed)
+        except OSError: # gone already, or still mapped on windows
+            continue
+        shutil.rmtree(removed, ignore_errors=True)
+        total -= size
@@ -0,0 +1,90 @@
+import queue
+import threading
+from pathlib import Path
+from concurrent.futures import Future
+
+from .const import Sizes
+from .memory import array_breakdown, mb
+from .song_cache import PreparedSong, load_prepared, prepare_song
+from .tracing import span
+
+def song_bytes(song:PreparedSong) -> int:
+    """ memory the arrays of a prepared song take, memory mapped ones included since reading them fills the page cache """
+    arrays = array_breakdown({"full": song.song_data_full, "mono": song.song_data_mono, "analysis": song.analysis})
+    return sum(array.nbytes for _, array in arrays)
+
+
+class SongQueue:
+    """ songs waiting to be opened after the current one, the next Sizes.prefetch_songs get decoded and analysed on a background
+    thread while the current one plays, as long as they fit in Sizes.prefetch_budget_mb """
+    def __init__(self) -> None:
+        self.paths:list[Path] = []
+        self.prefetched:dict[Path, Future] = {} # the future holds the PreparedSong, or None if it didnt fit in the budget
+        self.jobs:queue.Queue[tuple[Path, Future]] = queue.Queue()
+        threading.Thread(target=self.work, name="prefetch", daemon=True).start()
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def add(self, paths:list[Path]):
+        """ queues the songs, prefetching starts with the next call of prefetch """
+        self.paths += paths
+        print(f"{len(self.paths)} songs queued, N opens the next one")
+
+    def clear(self):
+        self.paths = []
+        self.prefetch()
+
+    def next(self) -> tuple[Path, PreparedSong|None]|None:
+        """ the next song and its prepared data if the prefetch got to it, None if the queue is empty """
+        if not self.paths:
+            return None
+        path = self.paths.pop(0)
+        future = self.prefetched.pop(path, None)
+        song = None
+        if future is not None and not future.cancelled():
+            try:
+                song = future.result() # waits if its being prepared right now instead of preparing it twice
+            except Exception as e:
+                print("prefetching", path, "failed:", e)
+        return path, song
+
+    def prefetch(self):
+        """ hands the next songs to the background thread and drops the ones that arent next anymore """
+        wanted = self.paths[:Sizes.prefetch_songs]
+        for path in list(self.prefetched):
+            if path not in wanted: # dropping the future drops its arrays, a running prepare finishes into nothing
+                self.prefetched.pop(path).cancel()
+        for path in wanted:
+            if path not in self.prefetched:
+                future = Future()
+                self.prefetched[path] = future
+                self.jobs.put((path, future))
+
+    def held_bytes(self) -> int:
+        return sum(
+            song_bytes(future.result()) for future in list(self.prefetched.values())
+            if future.done() and not future.cancelled() and not future.exception() and future.result() is not None
+        )
+
+    def work(self):
+        while True:
+            path, future = self.jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.prepare(path))
+            except Exception as e:
+                future.set_exception(e)
+
+    def prepare(self, path:Path) -> PreparedSong|None:
+        budget = Sizes.prefetch_budget_mb * 1024**2
+        if self.held_bytes() >= budget:
+            return None
+        with span("prefetch song", "load", song=path.name):
+            song = load_prepared(path) or prepare_song(path)
+        size = song_bytes(song)
+        if self.held_bytes() + size > budget:
+            print(f"not keeping {path.name} prefetched, its {mb(size)} dont fit in Sizes.prefetch_budget_mb")
+            return None
+        return song
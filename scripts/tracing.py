@@ -0,0 +1,96 @@
+""" records spans of loading and rendering as chrome trace event json, open it in chrome://tracing or https://ui.perfetto.dev
+
+off unless Sizes.trace is set or `python main.py --trace` is used, while off every span is a shared empty context manager
+"""
+import os
+import json
+import time
+import threading
+import subprocess
+from pathlib import Path
+from contextlib import contextmanager, nullcontext
+
+from .const import Paths, Sizes
+
+NO_SPAN = nullcontext()
+
+class Tracer:
+    """ collects complete events ("X") with the process and thread they happened in, thread safe """
+    def __init__(self) -> None:
+        self.enabled = Sizes.trace
+        self.events:list[dict] = []
+        self.names:dict[tuple[int, int], str] = {} # (pid, tid) -> thread or process name, written as metadata events
+        self.lock = threading.Lock()
+
+    def complete(self, name:str, category:str, start:float, end:float, args:dict|None = None, pid:int|None = None, tid:int|None = None):
+        """ start and end are time.perf_counter seconds, pid and tid default to the calling thread """
+        if pid is None:
+            pid = os.getpid()
+            tid = threading.get_ident()
+            key = pid, tid
+            if key not in self.names:
+                self.names[key] = threading.current_thread().name
+        event = {"name": name, "cat": category, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6, "pid": pid, "tid": tid or pid}
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    def process(self, pid:int, name:str, start:float, end:float, args:dict|None = None):
+        """ a subprocess, shown as its own process next to the one that waited for it """
+        self.names[pid, pid] = name
+        self.complete(name, "subprocess", start, end, args, pid, pid)
+
+    @contextmanager
+    def _span(self, name:str, category:str, args:dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start, time.perf_counter(), args)
+
+    def span(self, name:str, category:str = "", **args):
+        if not self.enabled:
+            return NO_SPAN
+        return self._span(name, category, args)
+
+    def trace(self) -> dict:
+        with self.lock:
+            events = list(self.events)
+        metadata = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for (pid, tid), name in self.names.items()
+        ]
+        metadata += [
+            {"name": "process_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for (pid, tid), name in self.names.items() if pid == tid # subprocesses
+        ]
+        metadata.append({"name": "process_name", "ph": "M", "pid": os.getpid(), "tid": 0, "args": {"name": "music-share"}})
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+    def save(self, path:Path|None = None):
+        """ writes everything recorded so far, does nothing while tracing is off """
+        if not self.enabled:
+            return
+        path = path or Paths.trace
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.trace()))
+        print(f"trace with {len(self.events)} spans written to {path}")
+
+tracer = Tracer()
+span = tracer.span
+
+def run(cmd:list[str], name:str, input:bytes|memoryview|None = None):
+    """ subprocess.run(cmd, check=True, input=input), traced as its own process when tracing is on """
+    if not tracer.enabled:
+        subprocess.run(cmd, check=True, input=input)
+        return
+    start = time.perf_counter()
+    with subprocess.Popen(cmd, stdin=subprocess.PIPE if input is not None else None) as process:
+        process.communicate(input)
+        returncode = process.wait()
+    end = time.perf_counter()
+    tracer.process(process.pid, name, start, end, {"cmd": " ".join(cmd)})
+    tracer.complete(f"waiting for {name}", "encode", start, end)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
@@ -1,8 +1,12 @@
 import string
+from io import BytesIO
+from pathlib import Path
 
 import pygame
 
 from .const import Colors, Fonts, Sizes
+from .helpers import time_to_str
+from .library import Library
 
 class CheckBox():
     def __init__(self, rect:pygame.Rect, checked:bool = False, background = True) -> None:
@@ -361,3 +365,87 @@ class MetadataTag:
 
         if updated: # if update flag checked
             self.draw() # redraw everything
+
+class LibraryBrowser:
+    def __init__(self, rect:pygame.Rect, library:Library) -> None:
+        self.rect = rect
+        self.library = library
+        self.search_box = TextField((rect.left + Sizes.meta_tag_padding, rect.top + Sizes.meta_tag_padding), "", True)
+        self.search_box.active = True # start typing right away
+        self.search_box.draw()
+        self.row_height = Fonts.medium.get_height() * 2
+        self.list_top = self.search_box.rect.bottom + Sizes.meta_tag_padding + Fonts.medium.get_height()
+        self.results = []
+        self.thumbnails:dict[str, pygame.Surface] = {} # only thumbnails of the current results are kept
+        self.count = 0 # tracks in the library, only counted again when the library changed
+        self.scroll = 0
+        self.refresh()
+
+    def refresh(self, changed:bool = True):
+        """ searches again, changed means the library itself changed instead of only the search text """
+        self.results = self.library.search(self.search_box.text, Sizes.library_results)
+        if changed:
+            self.library.changed = False
+            self.count = len(self.library)
+            self.thumbnails = {} # covers might have changed
+        self.scroll = min(self.scroll, max(0, len(self.results) - 1))
+        thumbnails = {path: self.thumbnails[path] for path, *_ in self.results if path in self.thumbnails}
+        missing = [path for path, *_ in self.results if path not in thumbnails]
+        for path, data in self.library.thumbnails(missing).items():
+            thumbnail = pygame.image.load(BytesIO(data), "thumbnail.png")
+            thumbnails[path] = pygame.transform.smoothscale(thumbnail, (self.row_height, self.row_height))
+        self.thumbnails = thumbnails
+
+    def row_at(self, pos:tuple[int,int]) -> int|None:
+        if pos[1] < self.list_top or not self.rect.collidepoint(pos):
+            return None
+        index = self.scroll + (pos[1] - self.list_top) // self.row_height
+        return index if index < len(self.results) else None
+
+    def draw(self) -> tuple[pygame.Surface, tuple[int,int]]:
+        if self.library.changed:
+            self.refresh()
+
+        surface = pygame.Surface(self.rect.size, pygame.SRCALPHA)
+        surface.fill(Colors.background)
+        surface.blit(self.search_box.surface, (self.search_box.pos[0] - self.rect.left, self.search_box.pos[1] - self.rect.top))
+
+        status = f"{self.count} tracks"
+        if self.library.scanning:
+            status += f", scanning {self.library.indexed}/{self.library.scanned}"
+        status_surface = Fonts.medium.render(status, True, Colors.bar_dim)
+        surface.blit(status_surface, (Sizes.meta_tag_padding, self.list_top - self.rect.top - status_surface.height))
+
+        y = self.list_top - self.rect.top
+        text_x = self.row_height + 2 * Sizes.meta_tag_padding
+        for path, artist, title, duration in self.results[self.scroll:]:
+            if y > self.rect.height:
+                break
+            if path in self.thumbnails:
+                surface.blit(self.thumbnails[path], (Sizes.meta_tag_padding, y))
+            name = f"{artist} - {title}" if artist or title else Path(path).name
+            surface.blit(Fonts.medium.render(name, True, Colors.text), (text_x, y))
+            info = time_to_str(duration) if duration else ""
+            surface.blit(Fonts.medium.render(info, True, Colors.bar_dim), (text_x, y + Fonts.medium.get_height()))
+            y += self.row_height
+
+        return surface, self.rect.topleft
+
+    def handle_event(self, event:pygame.Event) -> Path|None:
+        """ returns the path of the track that got picked """
+        if "text_changed" in self.search_box.handle_event(event):
+            self.scroll = 0
+            self.refresh(changed=False)
+        self.search_box.active = True
+
+        if event.type == pygame.MOUSEWHEEL:
+            self.scroll = min(max(0, self.scroll - event.y), max(0, len(self.results) - 1))
+
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            index = self.row_at(event.pos)
+            if index is not None:
+                return Path(self.results[index][0])
+
+        elif event.type == pygame.KEYDOWN and event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+            if self.results:
+                return Path(self.results[self.scroll][0])
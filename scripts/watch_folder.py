@@ -0,0 +1,102 @@
+""" watches folders for new or changed songs and prepares them in the background, so opening them in the app is instant
+
+start it with `python -m scripts.watch_folder /music/share`, without folders it watches the folders of the library
+"""
+import os
+import time
+import signal
+import argparse
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from .const import Sizes, AllowedFileTypes
+
+def ignore_interrupt():
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ctrl+c goes to the whole group, the pool is shut down by the watcher
+
+def prepare_file(path:str) -> float:
+    """ runs in a worker process, returns the seconds it took """
+    from .song_cache import is_prepared, prepare_song, store_prepared
+    start = time.perf_counter()
+    song_path = Path(path)
+    if not is_prepared(song_path):
+        store_prepared(song_path, prepare_song(song_path))
+    return time.perf_counter() - start
+
+
+class FolderWatcher:
+    """ polls the folders, waits until a changed file stopped changing and hands it to a capped pool of processes """
+    def __init__(self, folders:list[Path], workers:int = Sizes.watch_workers) -> None:
+        self.folders = folders
+        self.workers = workers
+        self.known:dict[str, tuple[int, int]] = {}                  # path -> (mtime, size) it was prepared with
+        self.pending:dict[str, tuple[tuple[int, int], float]] = {}  # path -> (mtime, size), time it last changed
+        self.queue:list[str] = []                                   # settled files waiting for a free worker
+        self.running:dict[Future, str] = {}
+
+    def poll(self):
+        """ moves files that stayed the same for Sizes.watch_debounce seconds into the queue """
+        now = time.monotonic()
+        for folder in self.folders:
+            for root, _, files in os.walk(folder):
+                for name in files:
+                    if Path(name).suffix.lower() not in AllowedFileTypes.audio:
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError: # deleted or moved meanwhile
+                        continue
+                    signature = stat.st_mtime_ns, stat.st_size
+                    if self.known.get(path) == signature or path in self.queue:
+                        continue
+                    previous = self.pending.get(path)
+                    if previous is None or previous[0] != signature:
+                        self.pending[path] = signature, now # new or still being written
+                    elif now - previous[1] >= Sizes.watch_debounce:
+                        del self.pending[path]
+                        self.known[path] = signature
+                        self.queue.append(path)
+
+    def collect(self):
+        for future in [f for f in self.running if f.done()]:
+            path = self.running.pop(future)
+            try:
+                print(f"prepared {path} in {future.result():.1f}s")
+            except Exception as e:
+                print("cant prepare", path, e)
+
+    def run(self):
+        print(f"watching {', '.join(map(str, self.folders))} with {self.workers} workers")
+        # spawn instead of fork, same as the library scanner
+        with ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"), ignore_interrupt) as executor:
+            while True:
+                self.poll()
+                self.collect()
+                # only hand out as many files as there are workers, a big copy waits here instead of in the pool
+                while self.queue and len(self.running) < self.workers:
+                    path = self.queue.pop(0)
+                    self.running[executor.submit(prepare_file, path)] = path
+                time.sleep(Sizes.watch_interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="prepares songs in watch folders for music-share")
+    parser.add_argument("folders", nargs="*", type=Path, help="defaults to the folders of the library")
+    parser.add_argument("--workers", type=int, default=Sizes.watch_workers)
+    args = parser.parse_args()
+
+    folders = args.folders
+    if not folders:
+        from .library import Library
+        folders = Library().folders()
+    if not folders:
+        parser.error("no folders given and the library has none")
+
+    try:
+        FolderWatcher(folders, args.workers).run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()